@@ -1,14 +1,32 @@
 import os
-from datetime import datetime
-from flask import Flask, send_from_directory, jsonify, request
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, set_access_cookies, unset_jwt_cookies
+from datetime import datetime, timezone
+from flask import Flask, Response, send_file, send_from_directory, jsonify, request
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt, get_jwt_identity, set_access_cookies, set_refresh_cookies, unset_jwt_cookies, verify_jwt_in_request, decode_token
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected
 from datetime import timedelta
 from functools import wraps # Dùng cho decorator phân quyền
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy.orm import joinedload
 from datetime import timedelta, date # Import date
+import atexit
+import json
+import math
+import contextvars
+import hashlib
+import shutil
+import uuid
+import threading
+import time
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import logging_setup
+import profiler
 
 
 # --- CẤU HÌNH CƠ BẢN ---
@@ -25,9 +43,14 @@ ADMIN_EMAILS = [
 
 
 # 1. Cấu hình Database (Sử dụng SQLite đơn giản)
-# Database sẽ được lưu trong tệp "site.db" trong thư mục gốc
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
+# Database sẽ được lưu trong tệp "site.db" trong thư mục gốc (DATABASE_URL để dùng database khác, vd. khi chạy test)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL") or 'sqlite:///site.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Engine chỉ đọc cho các route @db_route("read"): replica Postgres nếu có DATABASE_READ_URL,
+# ngược lại chính file site.db mở bằng URI mode=ro (pool riêng, không bao giờ giữ khoá ghi)
+app.config['SQLALCHEMY_BINDS'] = {
+    "doc": os.environ.get("DATABASE_READ_URL") or "sqlite:///file:site.db?mode=ro&uri=true"
+}
 app.config["JWT_SECRET_KEY"] = "your-very-strong-jwt-secret-key"  # <-- THAY THẾ BẰNG CHUỖI KHÁC
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
 app.config["JWT_TOKEN_LOCATION"] = ["cookies"]
@@ -35,10 +58,108 @@ app.config["JWT_COOKIE_SECURE"] = False  # Set True trong môi trường product
 app.config["JWT_COOKIE_SAMESITE"] = "Lax"
 app.config["JWT_COOKIE_SECURE"] = False  # dev OK, prod = True
 app.config["JWT_ACCESS_COOKIE_PATH"] = "/"
+app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
+app.config["JWT_REFRESH_COOKIE_PATH"] = "/"  # cả /api/auth/refresh-token lẫn alias /refresh-token
 app.config["JWT_COOKIE_CSRF_PROTECT"] = False 
+# Thời gian giữ hàng cho đơn chờ thanh toán online (bank/card)
+app.config["ORDER_RESERVATION_TTL"] = timedelta(minutes=15)
+app.config["ORDER_SWEEP_INTERVAL"] = 30  # giây
+app.config["ANALYTICS_COMPACT_INTERVAL"] = 3600  # giây
+# Điểm phổ biến: lượt xem/mua gom trong RAM, ghi xuống DB theo lô
+app.config["POPULARITY_FLUSH_INTERVAL"] = 10  # giây
+app.config["POPULARITY_HALF_LIFE"] = timedelta(days=7)
+app.config["POPULARITY_PURCHASE_WEIGHT"] = 5.0  # 1 sản phẩm bán ra = 5 lượt xem
+# Dời mốc của điểm phổ biến khi mốc cũ hơn khoảng này (26 chu kỳ bán rã: điểm nhỏ nhất ~2^-26 lần)
+app.config["POPULARITY_REBASE_AFTER"] = timedelta(days=182)
+app.config["BESTSELLER_LIMIT"] = 10
+# Danh sách JTI bị thu hồi được giữ trong RAM, đồng bộ từ DB mỗi N giây
+app.config["TOKEN_REVOCATION_SYNC_INTERVAL"] = 5  # giây
+# Chờ khoá tối đa 15s thay vì báo "database is locked" ngay khi nhiều người checkout cùng lúc
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = (
+    {"connect_args": {"timeout": 15}} if app.config['SQLALCHEMY_DATABASE_URI'].startswith("sqlite") else {}
+)
+# Giới hạn body mọi request (form multipart cũ): quá mức thì trả 413 trước khi đọc body
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+# Tải ảnh theo từng đoạn (/api/uploads)
+app.config["UPLOAD_MAX_IMAGE_SIZE"] = 20 * 1024 * 1024
+app.config["UPLOAD_CHUNK_MAX_SIZE"] = 4 * 1024 * 1024  # phải <= MAX_CONTENT_LENGTH
+app.config["UPLOAD_READ_SIZE"] = 64 * 1024  # RAM dùng cho mỗi upload đang nhận
+app.config["UPLOAD_SESSION_TTL"] = timedelta(hours=24)
+app.config["UPLOAD_CLEAN_INTERVAL"] = 600  # giây
+# Khuyến mãi: bật/tắt theo giờ bắt đầu/kết thúc, ghi giá hiệu lực vào product theo lô
+app.config["PROMOTION_TICK_INTERVAL"] = 5  # giây, độ trễ tối đa so với giờ bắt đầu/kết thúc
+app.config["PROMOTION_BATCH_SIZE"] = 500
+# Profile theo request cho admin (header X-Profile: 1 hoặc ?_profile=1), xem profiler.py
+app.config["PROFILER_ENABLED"] = os.environ.get("PROFILER_ENABLED", "1") != "0"
+app.config["PROFILER_DIR"] = os.path.join(app.instance_path, "profiles")
+app.config["PROFILER_MAX_FILES"] = 50
+app.config["PROFILER_MAX_AGE"] = timedelta(days=7)
+app.config["PROFILER_SAMPLE_INTERVAL"] = 0.001  # giây
+app.config["PROFILER_MAX_DURATION"] = 30  # giây, sau đó ngừng lấy mẫu
+app.config["PROFILER_MAX_SQL"] = 1000
+# Log JSON qua hàng đợi (logging_setup.py). Lấy mẫu DEBUG theo route, ví dụ:
+# LOG_DEBUG_SAMPLE_ROUTES="/api/checkout=1,/api/products/<int:product_id>=0.01"
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+app.config["LOG_DEBUG_SAMPLE_RATE"] = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", 0))
+app.config["LOG_DEBUG_SAMPLE_ROUTES"] = os.environ.get("LOG_DEBUG_SAMPLE_ROUTES", "")
+app.config["LOG_QUEUE_SIZE"] = 10000
+
+logging_setup.configure_logging(app.config)
+logging_setup.init_app(app)
+
+
+# --- ĐỊNH TUYẾN ĐỌC / GHI ---
+# Mặc định mọi route dùng engine chính. Route khai báo @db_route("read") đọc qua
+# engine "doc"; trong các route đó mọi lệnh ghi đều bị chặn, nên chúng không bao
+# giờ mở kết nối tới engine chính.
+_db_route = contextvars.ContextVar("db_route", default="write")
+
+
+class RoutingSession(FlaskSQLAlchemySession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _db_route.get() == "read":
+            # Chặn cả flush lẫn lệnh ghi hàng loạt (Query.update / delete, session.execute(update(...)))
+            if self._flushing or (clause is not None and clause.is_dml):
+                raise RuntimeError("Route chỉ đọc (@db_route('read')) không được ghi database")
+            return self._db.engines["doc"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def db_route(target):
+    """Chọn engine cho một route: "read" (engine chỉ đọc) hoặc "write" (engine chính)."""
+    if target not in ("read", "write"):
+        raise ValueError(f"db_route: {target!r}")
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            token = _db_route.set(target)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _db_route.reset(token)
+        decorator.db_route = target
+        return decorator
+    return wrapper
+
+
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Bật WAL cho SQLite để đọc không bị chặn bởi giao dịch ghi (checkout)."""
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=15000")
+        cursor.close()
 
 
-db = SQLAlchemy(app)
+# Chỉ gắn vào engine chính: đổi journal_mode là lệnh ghi, trên engine "doc" (mode=ro)
+# sẽ báo "attempt to write a readonly database" nếu file chưa ở chế độ WAL.
+# WAL được lưu trong file database nên engine "doc" vẫn đọc theo WAL.
+with app.app_context():
+    event.listen(db.engines[None], "connect", _sqlite_pragmas)
 
 # Initialize JWT manager
 jwt = JWTManager(app)
@@ -122,14 +243,16 @@ class Product(db.Model):
     stock = db.Column(db.Integer, default=10)
     image_url = db.Column(db.String(200))
     is_bestseller = db.Column(db.Boolean, default=False)
-    is_discounted = db.Column(db.Boolean, default=False)
+    is_discounted = db.Column(db.Boolean, default=False, index=True)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
     category_id = db.Column(db.Integer, db.ForeignKey("category.id"), nullable=False)
     shop_id = db.Column(db.Integer, db.ForeignKey("shop.id"))
 
 
-    def to_dict(self):
+    def to_dict(self, url_root=None):
+        # url_root: truyền vào khi gọi ngoài request Flask (vd. chế độ ASGI trong asgi.py)
+        url_root = (url_root or request.url_root).rstrip('/')
         # Resolve image filename: prefer public PNG/JPG variants only (no SVG fallback)
         image_url = None
         if self.image_url:
@@ -141,14 +264,14 @@ class Product(db.Model):
             # Prefer public PNG/JPG; do not return SVGs from images/
             for v in variants:
                 if os.path.exists(os.path.join(public_dir, v)):
-                    image_url = request.url_root.rstrip('/') + '/' + v
+                    image_url = url_root + '/' + v
                     break
 
             # Optional: if no public image found, try a generic no-image placeholder in public
             if not image_url:
                 placeholder = os.path.join(public_dir, 'no-image.jpg')
                 if os.path.exists(placeholder):
-                    image_url = request.url_root.rstrip('/') + '/no-image.jpg'
+                    image_url = url_root + '/no-image.jpg'
 
         return {
             'id': self.id,
@@ -231,17 +354,317 @@ class Feedback(db.Model):
         }
 
 
+# Hình thức thanh toán: "cod" trừ kho luôn, thanh toán online giữ hàng tới khi thanh toán xong
+HINH_THUC_THANH_TOAN = ("cod", "bank", "card")
+
+# Trạng thái hóa đơn (trùng với chuỗi hiển thị ở frontend)
+TRANG_THAI_CHO_THANH_TOAN = "chờ thanh toán"  # đang giữ hàng, hết hạn sau ORDER_RESERVATION_TTL
+TRANG_THAI_CHO_XU_LY = "chờ xử lý"
+TRANG_THAI_DANG_VAN_CHUYEN = "đang vận chuyển"
+TRANG_THAI_DA_GIAO = "đã giao"
+TRANG_THAI_DA_HUY = "đã hủy"
+TRANG_THAI_TRA_HANG = "trả hàng/hoàn tiền"
+
+# Các trạng thái mà hàng vẫn đang bị trừ khỏi kho -> hủy thì phải hoàn kho
+TRANG_THAI_GIU_HANG = (TRANG_THAI_CHO_THANH_TOAN, TRANG_THAI_CHO_XU_LY)
+
+# trạng thái đích -> các trạng thái nguồn được phép
+CHUYEN_TRANG_THAI = {
+    TRANG_THAI_CHO_XU_LY: (TRANG_THAI_CHO_THANH_TOAN,),
+    TRANG_THAI_DANG_VAN_CHUYEN: (TRANG_THAI_CHO_XU_LY,),
+    TRANG_THAI_DA_GIAO: (TRANG_THAI_DANG_VAN_CHUYEN,),
+    TRANG_THAI_TRA_HANG: (TRANG_THAI_DA_GIAO,),
+    TRANG_THAI_DA_HUY: TRANG_THAI_GIU_HANG,
+}
+
+# vai trò -> các trạng thái đích được phép chuyển tới.
+# Chỉ phía bán (chủ shop / admin) xác nhận thanh toán và giao hàng; người mua chỉ
+# được hủy đơn còn đang giữ hàng hoặc yêu cầu trả hàng sau khi đã nhận.
+QUYEN_CHUYEN_TRANG_THAI = {
+    "shop": {TRANG_THAI_CHO_XU_LY, TRANG_THAI_DANG_VAN_CHUYEN, TRANG_THAI_DA_GIAO, TRANG_THAI_DA_HUY},
+    "khach": {TRANG_THAI_DA_HUY, TRANG_THAI_TRA_HANG},
+}
+
+
+class HoaDon(db.Model):
+    __tablename__ = "hoa_don"
+    __table_args__ = (
+        db.Index("ix_hoa_don_trang_thai_het_han", "trang_thai", "het_han_giu"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    shop_id = db.Column(db.Integer, db.ForeignKey("shop.id"), index=True)
+
+    hinh_thuc_thanh_toan = db.Column(db.String(20), nullable=False)
+    trang_thai = db.Column(db.String(40), nullable=False, default=TRANG_THAI_CHO_XU_LY)
+    tong_tien = db.Column(db.Float, nullable=False, default=0.0)
+    giam_gia_tong_hd = db.Column(db.Float, nullable=False, default=0.0)
+    ghi_chu = db.Column(db.Text)
+
+    ngay_lap = db.Column(db.DateTime, default=datetime.utcnow)
+    het_han_giu = db.Column(db.DateTime)  # None = không giữ tạm (COD / đã thanh toán)
+
+    items = db.relationship("ChiTietHoaDon", backref="hoa_don", lazy=True)
+
+    def to_dict(self):
+        return {
+            "hoadon_id": self.id,
+            "khachhang_id": self.user_id,
+            "shop_id": str(self.shop_id) if self.shop_id is not None else "",
+            "hinh_thuc_thanh_toan": self.hinh_thuc_thanh_toan,
+            "trang_thai": self.trang_thai,
+            "tong_tien": self.tong_tien,
+            "giam_gia_tong_hd": self.giam_gia_tong_hd,
+            "ghi_chu": self.ghi_chu,
+            "ngay_lap": self.ngay_lap.isoformat() if self.ngay_lap else None,
+            "het_han_giu": self.het_han_giu.isoformat() if self.het_han_giu else None,
+        }
+
+
+class ChiTietHoaDon(db.Model):
+    __tablename__ = "chi_tiet_hoa_don"
+
+    id = db.Column(db.Integer, primary_key=True)
+    hoadon_id = db.Column(db.Integer, db.ForeignKey("hoa_don.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+
+    so_luong = db.Column(db.Integer, nullable=False)
+    don_gia = db.Column(db.Float, nullable=False)  # giá tại thời điểm đặt
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "hoadon_id": self.hoadon_id,
+            "sanpham_id": self.product_id,
+            "so_luong": self.so_luong,
+            "don_gia": self.don_gia,
+            "thanh_tien": self.don_gia * self.so_luong,
+        }
+
+
+# --- BẢNG THỐNG KÊ (ROLLUP) ---
+# Được cộng dồn ngay khi ghi (nhập kho, thêm/xóa sản phẩm, đánh giá) và được
+# job compaction tính lại định kỳ từ dữ liệu gốc. Dashboard chỉ đọc các bảng này.
+
+class GiaVonSanPham(db.Model):
+    """Tổng nhập của từng sản phẩm -> giá vốn bình quân gia quyền."""
+    __tablename__ = "gia_von_san_pham"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), primary_key=True)
+    so_luong_nhap = db.Column(db.Integer, nullable=False, default=0)
+    tong_gia_nhap = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def gia_von_tb(self):
+        return self.tong_gia_nhap / self.so_luong_nhap if self.so_luong_nhap else None
+
+
+class ThongKeNhapKhoNgay(db.Model):
+    __tablename__ = "thong_ke_nhap_kho_ngay"
+
+    kho_id = db.Column(db.Integer, db.ForeignKey("kho.id"), primary_key=True)
+    ngay = db.Column(db.Date, primary_key=True)
+    so_luong = db.Column(db.Integer, nullable=False, default=0)
+    gia_tri = db.Column(db.Float, nullable=False, default=0.0)
+
+    def to_dict(self):
+        return {
+            "kho_id": self.kho_id,
+            "ngay": self.ngay.isoformat(),
+            "so_luong": self.so_luong,
+            "gia_tri": self.gia_tri,
+        }
+
+
+class ThongKeSanPham(db.Model):
+    """Số sản phẩm theo shop và danh mục (shop_id = 0: sản phẩm không thuộc shop nào)."""
+    __tablename__ = "thong_ke_san_pham"
+
+    shop_id = db.Column(db.Integer, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    so_san_pham = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "shop_id": self.shop_id or None,
+            "category_id": self.category_id,
+            "so_san_pham": self.so_san_pham,
+        }
+
+
+class ThongKeFeedbackNgay(db.Model):
+    __tablename__ = "thong_ke_feedback_ngay"
+
+    shop_id = db.Column(db.Integer, db.ForeignKey("shop.id"), primary_key=True)
+    ngay = db.Column(db.Date, primary_key=True)
+    so_feedback = db.Column(db.Integer, nullable=False, default=0)
+    so_danh_gia = db.Column(db.Integer, nullable=False, default=0)  # feedback có rating
+    tong_diem = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "shop_id": self.shop_id,
+            "ngay": self.ngay.isoformat(),
+            "so_feedback": self.so_feedback,
+            "so_danh_gia": self.so_danh_gia,
+            "diem_tb": round(self.tong_diem / self.so_danh_gia, 2) if self.so_danh_gia else None,
+        }
+
+
+# --- GỢI Ý SẢN PHẨM ---
+# Top-K sản phẩm tương tự được tính offline bởi recommender.py; API chỉ đọc bảng này.
+
+class DiemPhoBien(db.Model):
+    """Lượt xem/mua và điểm phổ biến giảm dần theo thời gian của sản phẩm.
+
+    `score` lưu tổng các trọng số w * 2^((t - mốc) / half_life), nên cộng dồn được
+    bằng một phép cộng và sắp xếp theo cột này cũng chính là sắp xếp theo điểm đã
+    giảm dần tại thời điểm hiện tại. Mốc nằm trong MocDiemPhoBien và được dời lên
+    định kỳ (POPULARITY_REBASE_AFTER) để 2^x không bao giờ tràn số thực double.
+    """
+    __tablename__ = "diem_pho_bien"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), primary_key=True)
+    luot_xem = db.Column(db.Integer, nullable=False, default=0)
+    luot_mua = db.Column(db.Integer, nullable=False, default=0)
+    score = db.Column(db.Float, nullable=False, default=0.0, index=True)
+
+
+class MocDiemPhoBien(db.Model):
+    """Mốc thời gian hiện tại của diem_pho_bien.score (một dòng duy nhất, id = 1)."""
+    __tablename__ = "moc_diem_pho_bien"
+
+    id = db.Column(db.Integer, primary_key=True)
+    moc = db.Column(db.DateTime, nullable=False)
+
+
+class SanPhamTuongTu(db.Model):
+    __tablename__ = "san_pham_tuong_tu"
+
+    product_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)  # 0 = giống nhất
+    neighbor_id = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class TokenBiThuHoi(db.Model):
+    """JTI của access/refresh token đã bị thu hồi (đăng xuất, xoay vòng refresh token)."""
+    __tablename__ = "token_bi_thu_hoi"
+
+    jti = db.Column(db.String(36), primary_key=True)
+    token_type = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class SanPhamCanTinhLai(db.Model):
+    """Hàng đợi sản phẩm đã thay đổi, recommender.py chỉ tính lại các sản phẩm này."""
+    __tablename__ = "san_pham_can_tinh_lai"
+
+    product_id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class PhienTaiLen(db.Model):
+    """Phiên tải ảnh theo từng đoạn; da_nhan là số byte đã ghi xuống file tạm."""
+    __tablename__ = "phien_tai_len"
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    ten_file = db.Column(db.String(255))
+    loai_file = db.Column(db.String(50), nullable=False)
+    kich_thuoc = db.Column(db.Integer, nullable=False)
+    da_nhan = db.Column(db.Integer, nullable=False, default=0)
+    sha256 = db.Column(db.String(64))
+    image_url = db.Column(db.String(255))  # có giá trị khi đã tải xong
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    het_han = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.ten_file,
+            "content_type": self.loai_file,
+            "size": self.kich_thuoc,
+            "offset": self.da_nhan,
+            "complete": self.image_url is not None,
+            "image_url": self.image_url,
+            "sha256": self.sha256,
+            "expires_at": self.het_han.isoformat() if self.het_han else None,
+        }
+
+
+# --- KHUYẾN MÃI ---
+PHAM_VI_KHUYEN_MAI = ("san_pham", "danh_muc", "shop")
+KIEU_GIAM = ("phan_tram", "so_tien")
+
+
+class KhuyenMai(db.Model):
+    """Khuyến mãi có thời hạn cho một sản phẩm, một danh mục hoặc cả shop.
+
+    da_kich_hoat là trạng thái scheduler đã áp dụng lần gần nhất; scheduler chỉ
+    xử lý các khuyến mãi mà trạng thái này lệch với thời gian hiện tại.
+    """
+    __tablename__ = "khuyen_mai"
+    __table_args__ = (
+        db.Index("ix_khuyen_mai_kich_hoat_ket_thuc", "da_kich_hoat", "ket_thuc"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    ten = db.Column(db.String(100), nullable=False)
+    pham_vi = db.Column(db.String(20), nullable=False)  # PHAM_VI_KHUYEN_MAI
+    doi_tuong_id = db.Column(db.Integer, nullable=False)  # product_id / category_id / shop_id
+    kieu_giam = db.Column(db.String(20), nullable=False)  # KIEU_GIAM
+    gia_tri = db.Column(db.Float, nullable=False)  # % hoặc số tiền
+    bat_dau = db.Column(db.DateTime, nullable=False, index=True)  # UTC
+    ket_thuc = db.Column(db.DateTime, nullable=False)  # UTC
+    da_kich_hoat = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def gia_sau_giam(self, price):
+        if self.kieu_giam == "phan_tram":
+            return max(price * (1 - self.gia_tri / 100.0), 0.0)
+        return max(price - self.gia_tri, 0.0)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "ten": self.ten,
+            "pham_vi": self.pham_vi,
+            "doi_tuong_id": self.doi_tuong_id,
+            "kieu_giam": self.kieu_giam,
+            "gia_tri": self.gia_tri,
+            "bat_dau": self.bat_dau.isoformat() if self.bat_dau else None,
+            "ket_thuc": self.ket_thuc.isoformat() if self.ket_thuc else None,
+            "da_kich_hoat": self.da_kich_hoat,
+        }
+
+
+class GiaTruocKhuyenMai(db.Model):
+    """Giá giảm nhập tay của sản phẩm, giữ lại trong lúc khuyến mãi ghi đè lên product."""
+    __tablename__ = "gia_truoc_khuyen_mai"
+
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), primary_key=True)
+    discount_price = db.Column(db.Float)
+    is_discounted = db.Column(db.Boolean)
+
+
 # --- HÀM KHỞI TẠO DỮ LIỆU MẪU (CHỈ CHẠY MỘT LẦN) ---
 
 def initialize_database():
     """Tạo database và thêm dữ liệu mẫu nếu chưa có."""
     with app.app_context():
-        # Tạo tất cả các bảng nếu chúng chưa tồn tại
-        db.create_all()
+        # Tạo tất cả các bảng nếu chúng chưa tồn tại (trên engine chính; "doc" chỉ đọc)
+        db.create_all(bind_key=None)
+        # create_all không thêm index mới vào bảng đã có sẵn
+        for index in Product.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
         
         # Kiểm tra xem có dữ liệu danh mục nào chưa
         if Category.query.count() == 0:
-            print("Đang thêm dữ liệu mẫu...")
+            app.logger.info("Đang thêm dữ liệu mẫu...")
             
             # Thêm Danh mục
             cat_shoes = Category(name='Giày Dép', icon='shoe-icon')
@@ -281,7 +704,10 @@ def initialize_database():
             if not os.path.exists('images'):
                 os.makedirs('images')
             db.session.commit()
-            print("Hoàn tất thêm dữ liệu mẫu.")
+            app.logger.info("Hoàn tất thêm dữ liệu mẫu.")
+
+        # Dựng lại bảng thống kê cho dữ liệu đã có trước khi có rollup
+        rebuild_analytics_rollups()
             # app.py
 
 def admin_required():
@@ -304,6 +730,467 @@ def admin_required():
     return wrapper
 
 
+def _la_admin():
+    """Người gọi request hiện tại có phải admin không (không trả lỗi nếu thiếu / sai token)."""
+    try:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except Exception:
+        return False
+    user = db.session.get(User, int(user_id)) if user_id else None
+    return bool(user and user.is_admin)
+
+
+profiler.init_app(app, _la_admin)
+
+
+# --- JOB NỀN ---
+_background_jobs = set()
+_background_jobs_lock = threading.Lock()
+
+
+def _start_background_job(name, job, interval):
+    """Chạy `job()` mỗi `interval` giây trong một daemon thread có app context.
+
+    Mỗi process chỉ khởi động một lần cho mỗi `name`; gọi lại là no-op.
+    """
+    with _background_jobs_lock:
+        if name in _background_jobs:
+            return
+        _background_jobs.add(name)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    result = job()
+                    if result:
+                        app.logger.info("%s: %s", name, result, extra={"job": name})
+                except Exception:
+                    app.logger.exception("%s failed", name, extra={"job": name})
+                finally:
+                    db.session.remove()
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+
+
+# --- CẬP NHẬT THỐNG KÊ ---
+
+def _insert():
+    """Hàm `insert` có hỗ trợ ON CONFLICT theo dialect đang dùng."""
+    return pg_insert if db.session.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+
+def _upsert_cong_don(model, keys, deltas):
+    """INSERT ... ON CONFLICT DO UPDATE: cộng `deltas` vào dòng rollup có khóa `keys`."""
+    insert = _insert()
+    table = model.__table__
+    stmt = insert(table).values(**keys, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={col: table.c[col] + stmt.excluded[col] for col in deltas}
+    )
+    db.session.execute(stmt)
+
+
+def _ghi_nhan_nhap_kho(nhapkho):
+    ngay = (nhapkho.created_at or datetime.utcnow()).date()
+    _upsert_cong_don(
+        GiaVonSanPham,
+        {"product_id": nhapkho.product_id},
+        {"so_luong_nhap": nhapkho.so_luong, "tong_gia_nhap": nhapkho.so_luong * nhapkho.gia_nhap}
+    )
+    _upsert_cong_don(
+        ThongKeNhapKhoNgay,
+        {"kho_id": nhapkho.kho_id, "ngay": ngay},
+        {"so_luong": nhapkho.so_luong, "gia_tri": nhapkho.so_luong * nhapkho.gia_nhap}
+    )
+
+
+def _ghi_nhan_san_pham(shop_id, category_id, delta):
+    _upsert_cong_don(
+        ThongKeSanPham,
+        {"shop_id": shop_id or 0, "category_id": category_id},
+        {"so_san_pham": delta}
+    )
+
+
+def _ghi_nhan_feedback(fb):
+    ngay = (fb.created_at or datetime.utcnow()).date()
+    co_diem = fb.rating is not None
+    _upsert_cong_don(
+        ThongKeFeedbackNgay,
+        {"shop_id": fb.shop_id, "ngay": ngay},
+        {
+            "so_feedback": 1,
+            "so_danh_gia": 1 if co_diem else 0,
+            "tong_diem": int(fb.rating) if co_diem else 0,
+        }
+    )
+
+
+def _danh_dau_tinh_lai_goi_y(product_ids):
+    """Đưa sản phẩm vào hàng đợi tính lại gợi ý (recommender.py --incremental)."""
+    product_ids = {int(pid) for pid in product_ids if pid is not None}
+    if not product_ids:
+        return
+    now = datetime.utcnow()
+    stmt = _insert()(SanPhamCanTinhLai.__table__).values(
+        [{"product_id": pid, "created_at": now} for pid in product_ids]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={"created_at": stmt.excluded.created_at}
+    )
+    db.session.execute(stmt)
+
+
+def _as_date(value):
+    # func.date() của SQLite trả về chuỗi 'YYYY-MM-DD'
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _cau_hinh_rollup():
+    """(model, cột khoá, cột giá trị, câu lệnh tính lại từ dữ liệu gốc) của từng bảng rollup."""
+    ngay_nhap = db.func.date(NhapKho.created_at)
+    ngay_fb = db.func.date(Feedback.created_at)
+    shop_sp = db.func.coalesce(Product.shop_id, 0)
+    return [
+        (GiaVonSanPham, ("product_id",), ("so_luong_nhap", "tong_gia_nhap"), select(
+            NhapKho.product_id,
+            db.func.sum(NhapKho.so_luong),
+            db.func.sum(NhapKho.so_luong * NhapKho.gia_nhap)
+        ).group_by(NhapKho.product_id)),
+        (ThongKeNhapKhoNgay, ("kho_id", "ngay"), ("so_luong", "gia_tri"), select(
+            NhapKho.kho_id,
+            ngay_nhap,
+            db.func.sum(NhapKho.so_luong),
+            db.func.sum(NhapKho.so_luong * NhapKho.gia_nhap)
+        ).group_by(NhapKho.kho_id, ngay_nhap)),
+        (ThongKeSanPham, ("shop_id", "category_id"), ("so_san_pham",), select(
+            shop_sp,
+            Product.category_id,
+            db.func.count(Product.id)
+        ).group_by(shop_sp, Product.category_id)),
+        (ThongKeFeedbackNgay, ("shop_id", "ngay"), ("so_feedback", "so_danh_gia", "tong_diem"), select(
+            Feedback.shop_id,
+            ngay_fb,
+            db.func.count(Feedback.id),
+            db.func.count(Feedback.rating),
+            db.func.coalesce(db.func.sum(Feedback.rating), 0)
+        ).group_by(Feedback.shop_id, ngay_fb)),
+    ]
+
+
+def _doc_theo_khoa(rows, so_khoa):
+    return {
+        tuple(_as_date(v) for v in row[:so_khoa]): tuple(v or 0 for v in row[so_khoa:])
+        for row in rows
+    }
+
+
+def rebuild_analytics_rollups():
+    """Compaction: tính lại các bảng thống kê từ dữ liệu gốc và sửa phần lệch.
+
+    Chạy định kỳ ở job nền (không nằm trên đường đi của request) để sửa mọi
+    sai lệch của phần cộng dồn khi ghi. Phần tốn thời gian (quét nhap_kho,
+    feedback, product) chạy trong một snapshot chỉ đọc, không giữ khoá ghi:
+    giá trị đúng và giá trị đang lưu được đọc cùng một thời điểm, nên hiệu của
+    chúng là đúng phần lệch. Sau đó chỉ cộng phần lệch (ít dòng) vào bảng rollup
+    bằng upsert cộng dồn, nên phần request khác cộng vào sau snapshot vẫn giữ nguyên.
+    """
+    cau_hinh = _cau_hinh_rollup()
+    with db.engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite không tự BEGIN cho SELECT: mở giao dịch đọc để mọi SELECT dùng chung một snapshot (WAL)
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        snapshot = []
+        for model, khoa, cot, tinh_lai in cau_hinh:
+            dung = _doc_theo_khoa(conn.execute(tinh_lai), len(khoa))
+            dang_luu = _doc_theo_khoa(
+                conn.execute(select(*(model.__table__.c[c] for c in khoa + cot))), len(khoa)
+            )
+            snapshot.append((model, khoa, cot, dung, dang_luu))
+
+    so_dong = 0
+    try:
+        for model, khoa, cot, dung, dang_luu in snapshot:
+            for key in dung.keys() | dang_luu.keys():
+                moi = dung.get(key, (0,) * len(cot))
+                cu = dang_luu.get(key, (0,) * len(cot))
+                lech = {c: m - o for c, m, o in zip(cot, moi, cu) if not math.isclose(m, o, abs_tol=1e-6)}
+                if lech:
+                    _upsert_cong_don(model, dict(zip(khoa, key)), lech)
+                    so_dong += 1
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return f"sửa {so_dong} dòng thống kê" if so_dong else None
+
+
+def start_analytics_compactor(interval=None):
+    """Chạy job nền tính lại các bảng thống kê."""
+    _start_background_job(
+        "analytics-compactor",
+        rebuild_analytics_rollups,
+        interval or app.config["ANALYTICS_COMPACT_INTERVAL"]
+    )
+
+
+# --- ĐIỂM PHỔ BIẾN ---
+# Mỗi worker gom lượt xem/mua trong RAM; job nền ghi phần chênh lệch xuống DB
+# bằng một lệnh upsert theo lô, request không bao giờ ghi DB cho lượt xem.
+POPULARITY_EPOCH = datetime(2025, 1, 1)  # mốc ban đầu, trước lần dời mốc đầu tiên
+
+_tuong_tac_cho_ghi = {}  # product_id -> [luot_xem, luot_mua, score]
+_tuong_tac_moc = None  # mốc của các score trong _tuong_tac_cho_ghi: lúc có tương tác đầu tiên của lô
+_tuong_tac_lock = threading.Lock()
+
+
+def _trong_so_thoi_gian(now, moc):
+    """2^((now - moc) / half_life): trọng số của một tương tác xảy ra lúc `now` so với `moc`."""
+    half_life = app.config["POPULARITY_HALF_LIFE"].total_seconds()
+    return 2.0 ** ((now - moc).total_seconds() / half_life)
+
+
+def ghi_nhan_tuong_tac(product_id, luot_xem=0, luot_mua=0):
+    """Cộng lượt xem/mua vào bộ đếm trong RAM (không chạm DB)."""
+    global _tuong_tac_moc
+    now = datetime.utcnow()
+    with _tuong_tac_lock:
+        if not _tuong_tac_cho_ghi:
+            _tuong_tac_moc = now
+        diem = (luot_xem + luot_mua * app.config["POPULARITY_PURCHASE_WEIGHT"]) * _trong_so_thoi_gian(now, _tuong_tac_moc)
+        pending = _tuong_tac_cho_ghi.get(product_id)
+        if pending is None:
+            _tuong_tac_cho_ghi[product_id] = [luot_xem, luot_mua, diem]
+        else:
+            pending[0] += luot_xem
+            pending[1] += luot_mua
+            pending[2] += diem
+
+
+def _tra_lai_tuong_tac(pending, moc):
+    """Gộp lại một lô chưa ghi được vào bộ đếm (đổi score sang mốc của bộ đếm hiện tại)."""
+    global _tuong_tac_cho_ghi, _tuong_tac_moc
+    with _tuong_tac_lock:
+        if not _tuong_tac_cho_ghi:
+            _tuong_tac_cho_ghi, _tuong_tac_moc = pending, moc
+            return
+        he_so = _trong_so_thoi_gian(moc, _tuong_tac_moc)
+        for pid, (v, m, d) in pending.items():
+            cur = _tuong_tac_cho_ghi.setdefault(pid, [0, 0, 0.0])
+            cur[0] += v
+            cur[1] += m
+            cur[2] += d * he_so
+
+
+def _khoa_moc_diem_pho_bien(now):
+    """Khoá dòng mốc tới hết giao dịch và trả về mốc của diem_pho_bien.score.
+
+    Mốc cũ hơn POPULARITY_REBASE_AFTER thì dời lên `now`, chia mọi score cho
+    cùng một hệ số trong cùng giao dịch (thứ tự sắp xếp không đổi).
+    """
+    # UPDATE trước SELECT: giữ khoá ghi (SQLite) / khoá dòng (Postgres) ngay từ đầu,
+    # để worker khác không dời mốc giữa lúc đọc mốc và lúc ghi điểm
+    updated = MocDiemPhoBien.query.filter(MocDiemPhoBien.id == 1).update(
+        {MocDiemPhoBien.moc: MocDiemPhoBien.moc}, synchronize_session=False
+    )
+    if not updated:
+        db.session.execute(
+            _insert()(MocDiemPhoBien.__table__).values(id=1, moc=POPULARITY_EPOCH)
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+    moc = db.session.query(MocDiemPhoBien.moc).filter(MocDiemPhoBien.id == 1).scalar()
+    if now - moc > app.config["POPULARITY_REBASE_AFTER"]:
+        DiemPhoBien.query.update(
+            {DiemPhoBien.score: DiemPhoBien.score * _trong_so_thoi_gian(moc, now)},
+            synchronize_session=False
+        )
+        MocDiemPhoBien.query.filter(MocDiemPhoBien.id == 1).update(
+            {MocDiemPhoBien.moc: now}, synchronize_session=False
+        )
+        app.logger.info("popularity: dời mốc điểm từ %s sang %s", moc, now)
+        moc = now
+    return moc
+
+
+def flush_popularity_counters():
+    """Ghi toàn bộ phần đếm trong RAM xuống diem_pho_bien bằng một upsert theo lô."""
+    global _tuong_tac_cho_ghi
+    with _tuong_tac_lock:
+        pending, moc, _tuong_tac_cho_ghi = _tuong_tac_cho_ghi, _tuong_tac_moc, {}
+    if not pending:
+        return 0
+
+    table = DiemPhoBien.__table__
+    stmt = _insert()(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["product_id"],
+        set_={col: table.c[col] + stmt.excluded[col] for col in ("luot_xem", "luot_mua", "score")}
+    )
+    try:
+        he_so = _trong_so_thoi_gian(moc, _khoa_moc_diem_pho_bien(datetime.utcnow()))
+        # Sản phẩm đã bị xoá từ lúc được xem: bỏ đi, nếu không khoá ngoại làm hỏng cả lô
+        con_ton_tai = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(pending))}
+        rows = [
+            {"product_id": pid, "luot_xem": v, "luot_mua": m, "score": d * he_so}
+            for pid, (v, m, d) in pending.items() if pid in con_ton_tai
+        ]
+        if rows:
+            db.session.execute(stmt, rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Trả lại phần chưa ghi để lần flush sau thử lại
+        _tra_lai_tuong_tac(pending, moc)
+        raise
+    return len(rows)
+
+
+def start_popularity_flusher(interval=None):
+    """Chạy job nền ghi bộ đếm lượt xem/mua; ghi nốt phần còn lại khi process thoát."""
+    _start_background_job(
+        "popularity-flusher",
+        flush_popularity_counters,
+        interval or app.config["POPULARITY_FLUSH_INTERVAL"]
+    )
+
+    def flush_on_exit():
+        with app.app_context():
+            try:
+                flush_popularity_counters()
+            except Exception:
+                app.logger.exception("popularity-flusher failed on exit")
+
+    atexit.register(flush_on_exit)
+
+
+# --- THU HỒI TOKEN ---
+# Mỗi request có JWT chỉ tra một set trong RAM. Set được nạp đầy đủ ở lần kiểm
+# tra đầu tiên của process, sau đó job nền chỉ đọc các dòng mới thu hồi.
+# Thu hồi ở worker khác có hiệu lực ở worker này sau tối đa TOKEN_REVOCATION_SYNC_INTERVAL.
+_revoked_jtis = {}  # jti -> expires_at
+_revoked_lock = threading.Lock()
+_revoked_synced_at = None
+
+
+def sync_revoked_tokens():
+    """Nạp các JTI mới bị thu hồi từ DB và bỏ các JTI đã hết hạn khỏi RAM."""
+    global _revoked_synced_at
+    now = datetime.utcnow()
+    query = TokenBiThuHoi.query.with_entities(TokenBiThuHoi.jti, TokenBiThuHoi.expires_at).filter(
+        TokenBiThuHoi.expires_at > now
+    )
+    if _revoked_synced_at is not None:
+        # Lùi lại một chút để không sót các dòng commit trễ
+        query = query.filter(TokenBiThuHoi.revoked_at >= _revoked_synced_at - timedelta(minutes=1))
+    rows = query.all()
+    with _revoked_lock:
+        _revoked_jtis.update((row.jti, row.expires_at) for row in rows)
+        for jti in [jti for jti, exp in _revoked_jtis.items() if exp <= now]:
+            del _revoked_jtis[jti]
+        _revoked_synced_at = now
+    return None
+
+
+def revoke_token(jwt_payload):
+    """Ghi JTI vào bảng thu hồi và thêm ngay vào set của worker hiện tại."""
+    jti = jwt_payload["jti"]
+    expires_at = datetime.utcfromtimestamp(jwt_payload["exp"])
+    stmt = _insert()(TokenBiThuHoi.__table__).values(
+        jti=jti,
+        token_type=jwt_payload.get("type", "access"),
+        user_id=int(jwt_payload["sub"]) if str(jwt_payload.get("sub", "")).isdigit() else None,
+        expires_at=expires_at,
+        revoked_at=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["jti"])
+    db.session.execute(stmt)
+    with _revoked_lock:
+        _revoked_jtis[jti] = expires_at
+
+
+def is_token_revoked(jti):
+    """JTI đã bị thu hồi chưa. Chỉ tra set trong RAM (lần đầu của process thì nạp từ DB)."""
+    if _revoked_synced_at is None:
+        sync_revoked_tokens()
+    return jti in _revoked_jtis
+
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    return is_token_revoked(jwt_payload["jti"])
+
+
+def start_revocation_sync(interval=None):
+    """Chạy job nền đồng bộ danh sách token bị thu hồi và dọn bản ghi đã hết hạn."""
+    def job():
+        sync_revoked_tokens()
+        TokenBiThuHoi.query.filter(TokenBiThuHoi.expires_at <= datetime.utcnow()).delete()
+        db.session.commit()
+
+    _start_background_job(
+        "revocation-sync",
+        job,
+        interval or app.config["TOKEN_REVOCATION_SYNC_INTERVAL"]
+    )
+
+
+# --- TRUY VẤN DÙNG CHUNG ---
+# Câu lệnh select() cho các API catalog, được cả view Flask ở dưới lẫn asgi.py
+# (async session) thực thi, để hai chế độ phục vụ luôn trả cùng kết quả.
+
+def truy_van_ban_chay(limit):
+    """Sản phẩm xếp theo điểm phổ biến (lượt xem/mua giảm dần theo thời gian), dùng index trên score."""
+    return select(Product).join(DiemPhoBien, DiemPhoBien.product_id == Product.id).order_by(
+        DiemPhoBien.score.desc()
+    ).limit(limit)
+
+
+def truy_van_ban_chay_dat_tay():
+    """Chưa có dữ liệu tương tác: dùng cờ is_bestseller đặt tay."""
+    return select(Product).filter_by(is_bestseller=True)
+
+
+def truy_van_tuong_tu(product_id, limit):
+    """id các sản phẩm tương tự với `product_id`, giống nhất trước."""
+    return select(SanPhamTuongTu.neighbor_id).filter(
+        SanPhamTuongTu.product_id == product_id
+    ).order_by(SanPhamTuongTu.rank).limit(limit)
+
+
+def truy_van_da_mua_gan_day(user_id, limit=20):
+    """id các sản phẩm `user_id` đã mua gần đây."""
+    return select(ChiTietHoaDon.product_id).join(
+        HoaDon, HoaDon.id == ChiTietHoaDon.hoadon_id
+    ).filter(HoaDon.user_id == user_id).order_by(HoaDon.ngay_lap.desc()).limit(limit)
+
+
+def truy_van_goi_y_theo_da_mua(da_mua, limit):
+    """id các sản phẩm tương tự với những sản phẩm đã mua (chưa mua), cộng điểm tương tự."""
+    return select(SanPhamTuongTu.neighbor_id).filter(
+        SanPhamTuongTu.product_id.in_(da_mua), SanPhamTuongTu.neighbor_id.notin_(da_mua)
+    ).group_by(SanPhamTuongTu.neighbor_id).order_by(db.func.sum(SanPhamTuongTu.score).desc()).limit(limit)
+
+
+def truy_van_san_pham_theo_id(ids):
+    return select(Product).filter(Product.id.in_(ids))
+
+
+def truy_van_san_pham_moi(limit=3):
+    return select(Product).order_by(Product.date_added.desc()).limit(limit)
+
+
+def sap_theo_ids(products, ids):
+    """Sắp `products` theo thứ tự của `ids` (bỏ id không còn sản phẩm)."""
+    by_id = {p.id: p for p in products}
+    return [by_id[pid] for pid in ids if pid in by_id]
+
+
 # --- API ENDPOINTS ---
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
@@ -311,6 +1198,7 @@ def uploaded_file(filename):
 
 
 @app.route('/api/categories', methods=['GET'])
+@db_route("read")
 def get_categories():
     """Lấy danh sách các danh mục."""
     categories = Category.query.all()
@@ -318,6 +1206,7 @@ def get_categories():
     return jsonify([c.to_dict() for c in categories])
 
 @app.route('/api/products/discount', methods=['GET'])
+@db_route("read")
 def get_discount_products():
     """Lấy danh sách sản phẩm giảm giá."""
     # Lọc các sản phẩm có is_discounted = True
@@ -328,25 +1217,54 @@ def get_discount_products():
     })
 
 @app.route('/api/products/bestseller', methods=['GET'])
+@db_route("read")
 def get_bestseller_products():
     """Lấy danh sách sản phẩm bán chạy nhất."""
-    # Lọc các sản phẩm có is_bestseller = True
-    products = Product.query.filter_by(is_bestseller=True).all()
+    products = db.session.scalars(truy_van_ban_chay(app.config["BESTSELLER_LIMIT"])).all()
+    if not products:
+        products = db.session.scalars(truy_van_ban_chay_dat_tay()).all()
     return jsonify({
         "title": "Sản phẩm bán chạy hàng đầu",
         "products": [p.to_dict() for p in products]
     })
 
 @app.route('/api/products/suggested', methods=['GET'])
+@db_route("read")
 def get_suggested_products():
-    """Lấy danh sách sản phẩm gợi ý (có thể là sản phẩm bán chạy hoặc mới nhất)."""
-    # Lấy 3 sản phẩm gần nhất
-    products = Product.query.order_by(Product.date_added.desc()).limit(3).all()
+    """Lấy danh sách sản phẩm gợi ý.
+
+    - ?product_id=: sản phẩm tương tự với sản phẩm đang xem
+    - đã đăng nhập: gộp các sản phẩm tương tự với những sản phẩm đã mua gần đây
+    - còn lại (hoặc chưa có dữ liệu gợi ý): 3 sản phẩm mới nhất
+    """
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    product_id = request.args.get('product_id', type=int)
+    try:
+        # Token hết hạn/không hợp lệ thì vẫn trả gợi ý chung thay vì 401
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except Exception:
+        user_id = None
+
+    ids = []
+    if product_id:
+        ids = db.session.scalars(truy_van_tuong_tu(product_id, limit)).all()
+    elif user_id:
+        da_mua = db.session.scalars(truy_van_da_mua_gan_day(int(user_id))).all()
+        if da_mua:
+            ids = db.session.scalars(truy_van_goi_y_theo_da_mua(da_mua, limit)).all()
+
+    if ids:
+        products = sap_theo_ids(db.session.scalars(truy_van_san_pham_theo_id(ids)).all(), ids)
+    else:
+        # Lấy 3 sản phẩm gần nhất
+        products = db.session.scalars(truy_van_san_pham_moi()).all()
     return jsonify({
         "title": "Sản phẩm gợi ý cho bạn",
         "products": [p.to_dict() for p in products]
     })
 @app.route('/api/products/<int:product_id>', methods=['GET'])
+@db_route("read")
 def get_product_details(product_id):
     """Lấy chi tiết một sản phẩm theo ID."""
     
@@ -357,6 +1275,9 @@ def get_product_details(product_id):
     if not product:
         # Flask trả về lỗi 404
         return jsonify({"error": "Product not found"}), 404
+
+    # Đếm lượt xem trong RAM, job nền sẽ ghi theo lô
+    ghi_nhan_tuong_tac(product.id, luot_xem=1)
     
     # 3. Tìm Category (để trả về thông tin chi tiết hơn)
     category = Category.query.get(product.category_id)
@@ -448,6 +1369,7 @@ def login():
         return jsonify({"msg": "Sai tài khoản hoặc mật khẩu"}), 401
 
     access_token = create_access_token(identity=str(user.id))
+    refresh_jwt = create_refresh_token(identity=str(user.id))
 
     response = jsonify({
         "msg": "Đăng nhập thành công",
@@ -455,6 +1377,7 @@ def login():
     })
 
     set_access_cookies(response, access_token)
+    set_refresh_cookies(response, refresh_jwt)
     return response
     
 @app.route('/api/auth/me', methods=['GET'])
@@ -500,8 +1423,27 @@ from flask_jwt_extended import (
 )
 
 @app.route('/api/auth/logout', methods=['POST'])
-@jwt_required(optional=True)
 def logout():
+    # Thu hồi cả access token lẫn refresh token (nếu còn) để không dùng lại được.
+    # Không dùng @jwt_required: access token hết hạn (để lâu không dùng) vẫn phải
+    # đăng xuất được và vẫn phải thu hồi refresh token.
+    payloads = []
+    for cookie_name in (app.config["JWT_ACCESS_COOKIE_NAME"], app.config["JWT_REFRESH_COOKIE_NAME"]):
+        token = request.cookies.get(cookie_name)
+        if not token:
+            continue
+        try:
+            payloads.append(decode_token(token, allow_expired=True))
+        except Exception:
+            pass  # token giả / sai chữ ký: không có gì để thu hồi
+    try:
+        for payload in payloads:
+            revoke_token(payload)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("logout failed")
+
     response = jsonify({
         "msg": "Đăng xuất thành công"
     })
@@ -541,6 +1483,308 @@ def create_shop():
         "shop": shop.to_dict()
     }), 201
 
+# --- TẢI ẢNH LÊN (STREAMING, TIẾP TỤC ĐƯỢC) ---
+# 1. POST  /api/uploads {filename, content_type, size}: kiểm tra loại và dung lượng
+#    trước khi nhận byte nào, trả về upload_id.
+# 2. PATCH /api/uploads/<id>, header Upload-Offset, body là byte thô của một đoạn.
+#    Request phải giữ được khoá file (flock, không chờ) của upload trước khi đọc body,
+#    nên hai PATCH cùng lúc chỉ có một request được ghi, request kia nhận 409 ngay.
+#    Body được đọc từ socket từng khối UPLOAD_READ_SIZE, ghi thẳng vào file .part tại
+#    offset và băm SHA-256 cùng lúc, nên worker không bao giờ giữ cả ảnh trong RAM.
+# 3. GET   /api/uploads/<id>: số byte đã nhận, để client tiếp tục sau khi rớt mạng.
+# Khi nhận đủ, file được đổi tên (không copy lại) thành public/images/prod_<sha256>.<ext>,
+# rồi dùng `upload_id` khi tạo sản phẩm.
+
+ANH_CHO_PHEP = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+# Trạng thái SHA-256 của các upload đang nhận trong process này: upload_id -> (offset, hasher).
+# Đoạn tiếp theo đến worker khác (hoặc sau restart) thì băm lại phần đã có trên đĩa.
+_upload_hashers = {}
+_upload_hashers_lock = threading.Lock()
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ chạy dev server một process
+    fcntl = None
+_upload_file_locks = {}  # chỉ dùng khi không có fcntl (dev server): upload_id -> threading.Lock
+
+
+def _thu_khoa_file_tai_len(upload_id, f):
+    """Thử khoá độc quyền file .part (giữa các thread lẫn các worker), không chờ.
+
+    False nếu một request khác đang ghi vào upload này.
+    """
+    if fcntl:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+    with _upload_hashers_lock:
+        lock = _upload_file_locks.setdefault(upload_id, threading.Lock())
+    return lock.acquire(blocking=False)
+
+
+def _nha_khoa_file_tai_len(upload_id, f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        _upload_file_locks[upload_id].release()
+
+
+def _khop_dinh_dang(loai_file, head):
+    """So magic bytes đầu file với content_type đã khai báo."""
+    if loai_file == "image/jpeg":
+        return head[:3] == b"\xff\xd8\xff"
+    if loai_file == "image/png":
+        return head[:8] == b"\x89PNG\r\n\x1a\n"
+    if loai_file == "image/gif":
+        return head[:6] in (b"GIF87a", b"GIF89a")
+    if loai_file == "image/webp":
+        return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    return False
+
+
+def _file_tai_len_tam(upload_id):
+    upload_dir = os.path.join(app.instance_path, "uploads")
+    os.makedirs(upload_dir, exist_ok=True)
+    return os.path.join(upload_dir, upload_id + ".part")
+
+
+def _hasher_tai(upload_id, path, offset):
+    """Hasher đã băm đúng `offset` byte đầu của file tạm."""
+    with _upload_hashers_lock:
+        cached = _upload_hashers.get(upload_id)
+    if cached and cached[0] == offset:
+        return cached[1].copy()
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(path, "rb") as f:
+        while remaining:
+            block = f.read(min(app.config["UPLOAD_READ_SIZE"], remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def _hoan_tat_tai_len(upload_id, path, loai_file, hasher):
+    """Chuyển file tạm vào public/images theo hash nội dung và đánh dấu phiên đã xong."""
+    digest = hasher.hexdigest()
+    filename = f"prod_{digest}{ANH_CHO_PHEP[loai_file]}"
+    images_dir = os.path.join(app.static_folder, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    dest = os.path.join(images_dir, filename)
+    if os.path.exists(dest):
+        os.remove(path)  # ảnh cùng nội dung đã có
+    else:
+        shutil.move(path, dest)  # os.rename nếu cùng filesystem
+    PhienTaiLen.query.filter(PhienTaiLen.id == upload_id).update(
+        {PhienTaiLen.sha256: digest, PhienTaiLen.image_url: f"images/{filename}"},
+        synchronize_session=False
+    )
+    db.session.commit()
+    with _upload_hashers_lock:
+        _upload_hashers.pop(upload_id, None)
+
+
+def _anh_da_tai_len(upload_id, user_id):
+    """image_url của một upload đã xong thuộc `user_id`, ngược lại None."""
+    phien = db.session.get(PhienTaiLen, upload_id)
+    if phien and phien.user_id == user_id and phien.image_url:
+        return phien.image_url
+    return None
+
+
+def clean_expired_uploads():
+    """Xoá phiên tải lên hết hạn cùng file tạm còn dở."""
+    expired = PhienTaiLen.query.filter(PhienTaiLen.het_han < datetime.utcnow()).limit(500).all()
+    for phien in expired:
+        if not phien.image_url:
+            try:
+                os.remove(_file_tai_len_tam(phien.id))
+            except FileNotFoundError:
+                pass
+        with _upload_hashers_lock:
+            _upload_hashers.pop(phien.id, None)
+        db.session.delete(phien)
+    db.session.commit()
+    return len(expired)
+
+
+def start_upload_cleaner(interval=None):
+    """Chạy job nền dọn phiên tải lên hết hạn."""
+    _start_background_job(
+        "upload-cleaner",
+        clean_expired_uploads,
+        interval or app.config["UPLOAD_CLEAN_INTERVAL"]
+    )
+
+
+@app.route('/api/uploads', methods=['POST'])
+@jwt_required()
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    loai_file = data.get('content_type')
+    try:
+        kich_thuoc = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({"status": False, "msg": "size không hợp lệ"}), 400
+
+    if loai_file not in ANH_CHO_PHEP:
+        return jsonify({"status": False, "msg": "Chỉ nhận ảnh " + ", ".join(ANH_CHO_PHEP)}), 415
+    if kich_thuoc <= 0 or kich_thuoc > app.config["UPLOAD_MAX_IMAGE_SIZE"]:
+        return jsonify({
+            "status": False,
+            "msg": f"Ảnh tối đa {app.config['UPLOAD_MAX_IMAGE_SIZE']} byte"
+        }), 413
+
+    phien = PhienTaiLen(
+        id=uuid.uuid4().hex,
+        user_id=int(get_jwt_identity()),
+        ten_file=secure_filename(data.get('filename') or '')[:255] or None,
+        loai_file=loai_file,
+        kich_thuoc=kich_thuoc,
+        da_nhan=0,
+        het_han=datetime.utcnow() + app.config["UPLOAD_SESSION_TTL"]
+    )
+    open(_file_tai_len_tam(phien.id), "wb").close()
+    db.session.add(phien)
+    db.session.commit()
+    result = phien.to_dict()
+    result["chunk_size"] = app.config["UPLOAD_CHUNK_MAX_SIZE"]
+    return jsonify({"status": "success", "upload": result}), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_upload(upload_id):
+    phien = db.session.get(PhienTaiLen, upload_id)
+    if not phien or phien.user_id != int(get_jwt_identity()):
+        return jsonify({"status": False, "msg": "Upload not found"}), 404
+    response = jsonify({"status": "success", "upload": phien.to_dict()})
+    response.headers["Upload-Offset"] = str(phien.da_nhan)
+    return response
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@jwt_required()
+def upload_chunk(upload_id):
+    phien = db.session.get(PhienTaiLen, upload_id)
+    if not phien or phien.user_id != int(get_jwt_identity()):
+        return jsonify({"status": False, "msg": "Upload not found"}), 404
+    if phien.image_url:
+        return jsonify({"status": "success", "upload": phien.to_dict()})
+
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return jsonify({"status": False, "msg": "Thiếu header Upload-Offset"}), 400
+    if offset != phien.da_nhan:
+        # Client gửi lại từ offset mà server đang có
+        return jsonify({"status": False, "msg": "Sai offset", "offset": phien.da_nhan}), 409
+
+    # Kiểm tra dung lượng theo Content-Length, trước khi đọc body
+    length = request.content_length
+    if length is None:
+        return jsonify({"status": False, "msg": "Thiếu Content-Length"}), 411
+    if length > app.config["UPLOAD_CHUNK_MAX_SIZE"] or offset + length > phien.kich_thuoc:
+        return jsonify({
+            "status": False,
+            "msg": "Đoạn quá lớn",
+            "chunk_size": app.config["UPLOAD_CHUNK_MAX_SIZE"],
+            "offset": phien.da_nhan
+        }), 413
+
+    loai_file, kich_thuoc = phien.loai_file, phien.kich_thuoc
+    db.session.rollback()
+
+    path = _file_tai_len_tam(upload_id)
+    try:
+        f = open(path, "r+b")
+    except FileNotFoundError:
+        # Request khác vừa hoàn tất upload (file đã chuyển đi), hoặc phiên đã bị dọn
+        phien = db.session.get(PhienTaiLen, upload_id)
+        if phien and phien.image_url:
+            return jsonify({"status": "success", "upload": phien.to_dict()})
+        return jsonify({"status": False, "msg": "Upload not found"}), 404
+    with f:
+        if not _thu_khoa_file_tai_len(upload_id, f):
+            return jsonify({"status": False, "msg": "Đang nhận một đoạn khác của upload này", "offset": offset}), 409
+        try:
+            # Đọc lại offset khi đã giữ khoá: request vừa nhả khoá có thể đã ghi đoạn này
+            phien = db.session.get(PhienTaiLen, upload_id)
+            if not phien:
+                return jsonify({"status": False, "msg": "Upload not found"}), 404
+            if phien.image_url:
+                return jsonify({"status": "success", "upload": phien.to_dict()})
+            if phien.da_nhan != offset:
+                return jsonify({"status": False, "msg": "Sai offset", "offset": phien.da_nhan}), 409
+            # Không giữ giao dịch đọc SQLite trong lúc chờ client chậm gửi body
+            db.session.rollback()
+
+            hasher = _hasher_tai(upload_id, path, offset)
+            read_size = app.config["UPLOAD_READ_SIZE"]
+            stream = request.stream
+            written = 0
+            disconnected = False
+            # Chỉ cắt phần sau offset đã ghi nhận (rác của lần ghi trước bị ngắt giữa chừng)
+            f.truncate(offset)
+            f.seek(offset)
+            try:
+                if offset == 0:
+                    # Kiểm tra magic bytes ngay từ những byte đầu tiên
+                    head = b""
+                    while len(head) < min(12, length):
+                        block = stream.read(min(12, length) - len(head))
+                        if not block:
+                            break
+                        head += block
+                    if not _khop_dinh_dang(loai_file, head):
+                        return jsonify({"status": False, "msg": "Nội dung không phải " + loai_file}), 415
+                    f.write(head)
+                    hasher.update(head)
+                    written = len(head)
+                while written < length:
+                    block = stream.read(min(read_size, length - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    hasher.update(block)
+                    written += len(block)
+            except ClientDisconnected:
+                disconnected = True  # giữ phần đã nhận, client tiếp tục từ offset mới
+            f.flush()
+
+            new_offset = offset + written
+            updated = PhienTaiLen.query.filter(
+                PhienTaiLen.id == upload_id,
+                PhienTaiLen.da_nhan == offset
+            ).update({PhienTaiLen.da_nhan: new_offset}, synchronize_session=False)
+            db.session.commit()
+            if not updated:  # phiên vừa bị job dọn dẹp xoá
+                return jsonify({"status": False, "msg": "Upload not found"}), 404
+            with _upload_hashers_lock:
+                _upload_hashers[upload_id] = (new_offset, hasher)
+            if new_offset == kich_thuoc:
+                # Vẫn giữ khoá: request đến sau thấy image_url thay vì ghi vào file đã chuyển đi
+                _hoan_tat_tai_len(upload_id, path, loai_file, hasher)
+                return jsonify({"status": "success", "upload": db.session.get(PhienTaiLen, upload_id).to_dict()})
+        finally:
+            _nha_khoa_file_tai_len(upload_id, f)
+
+    if disconnected or written < length:
+        return jsonify({"status": False, "msg": "Mất kết nối", "offset": new_offset}), 400
+    response = jsonify({"status": "success", "offset": new_offset})
+    response.headers["Upload-Offset"] = str(new_offset)
+    return response
+
 # --- Admin / Kho endpoints ---
 @app.route('/api/admin/addSanpham', methods=['POST'])
 @jwt_required()
@@ -563,6 +1807,14 @@ def admin_add_sanpham():
             images_dir = os.path.join(app.static_folder, 'images')
             os.makedirs(images_dir, exist_ok=True)
             image_file.save(os.path.join(images_dir, filename))
+        image_url = f"/images/{filename}" if filename else "/images/no-image.jpg"
+
+        # ảnh đã tải trước qua /api/uploads
+        upload_id = request.form.get('upload_id') or (request.json.get('upload_id') if request.is_json else None)
+        if upload_id and not filename:
+            image_url = _anh_da_tai_len(upload_id, int(get_jwt_identity()))
+            if not image_url:
+                return jsonify({"status": False, "msg": "upload_id không hợp lệ hoặc chưa tải xong"}), 400
 
         # fallback defaults
         if not category_id:
@@ -575,18 +1827,20 @@ def admin_add_sanpham():
             price=price,
             discount_price=0.0,
             stock=int(stock) if stock else 0,
-            image_url = f"/images/{filename}" if filename else "/images/no-image.jpg",
+            image_url=image_url,
             category_id=int(category_id) if category_id else (cat.id if (cat:=Category.query.first()) else 1),
             shop_id=int(shop_id) if shop_id else None
         )
         db.session.add(p)
+        _ghi_nhan_san_pham(p.shop_id, p.category_id, 1)
+        db.session.flush()
+        _danh_dau_tinh_lai_goi_y([p.id])
         db.session.commit()
+        _ap_dung_khuyen_mai([p.id])  # khuyến mãi theo danh mục / shop đang chạy
         return jsonify({"status": "success", "product": p.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
-        print('[admin_add_sanpham] Exception:', e)
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("admin_add_sanpham failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 @app.route('/api/shop/product', methods=['POST'])
@@ -610,6 +1864,11 @@ def add_product():
     if file:
         filename = secure_filename(file.filename)
         file.save(os.path.join('images', filename))
+    elif request.form.get('upload_id'):
+        # ảnh đã tải trước qua /api/uploads
+        filename = _anh_da_tai_len(request.form['upload_id'], user_id)
+        if not filename:
+            return jsonify({"msg": "upload_id không hợp lệ hoặc chưa tải xong"}), 400
 
     product = Product(
         name=name,
@@ -621,7 +1880,11 @@ def add_product():
     )
 
     db.session.add(product)
+    _ghi_nhan_san_pham(product.shop_id, product.category_id, 1)
+    db.session.flush()
+    _danh_dau_tinh_lai_goi_y([product.id])
     db.session.commit()
+    _ap_dung_khuyen_mai([product.id])  # khuyến mãi theo danh mục / shop đang chạy
 
     return jsonify({
         "msg": "Thêm sản phẩm thành công",
@@ -630,6 +1893,7 @@ def add_product():
 
 
 @app.route('/api/admin/xemsanpham', methods=['GET'])
+@db_route("read")
 @jwt_required()
 def admin_xemsanpham():
     # optional query param shop_id
@@ -641,10 +1905,11 @@ def admin_xemsanpham():
             prods = Product.query.all()
         return jsonify({"status": "success", "products": [p.to_dict() for p in prods]})
     except Exception as e:
-        print('[admin_xemsanpham] Exception:', e)
+        app.logger.exception("admin_xemsanpham failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 @app.route('/api/admin/xemkho', methods=['GET'])
+@db_route("read")
 @jwt_required()
 def admin_xemkho():
     danh_sach_kho = Kho.query.order_by(Kho.created_at.desc()).all()
@@ -669,14 +1934,26 @@ def admin_suasanpham(sp_id):
         p = Product.query.get(sp_id)
         if not p:
             return jsonify({"status": False, "msg": "Product not found"}), 404
+        old_category_id = p.category_id
         for k in ['name', 'price', 'discount_price', 'stock', 'image_url', 'category_id']:
             if k in data:
                 setattr(p, k, data[k])
+        if 'category_id' in data and int(p.category_id) != old_category_id:
+            _ghi_nhan_san_pham(p.shop_id, old_category_id, -1)
+            _ghi_nhan_san_pham(p.shop_id, int(p.category_id), 1)
+        if {'price', 'category_id'} & set(data):
+            _danh_dau_tinh_lai_goi_y([p.id])
+        goc = db.session.get(GiaTruocKhuyenMai, p.id)
+        if goc is not None and 'discount_price' in data:
+            # Đang có khuyến mãi: giá nhập tay được giữ riêng, product giữ giá hiệu lực
+            goc.discount_price = data['discount_price']
         db.session.commit()
+        if {'price', 'category_id', 'discount_price'} & set(data):
+            _ap_dung_khuyen_mai([p.id])
         return jsonify({"status": "success", "product": p.to_dict()})
     except Exception as e:
         db.session.rollback()
-        print('[admin_suasanpham] Exception:', e)
+        app.logger.exception("admin_suasanpham failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 
@@ -687,12 +1964,17 @@ def admin_deletesanpham(sp_id):
         p = Product.query.get(sp_id)
         if not p:
             return jsonify({"status": False, "msg": "Product not found"}), 404
+        _ghi_nhan_san_pham(p.shop_id, p.category_id, -1)
+        GiaVonSanPham.query.filter_by(product_id=p.id).delete()
+        DiemPhoBien.query.filter_by(product_id=p.id).delete()
+        GiaTruocKhuyenMai.query.filter_by(product_id=p.id).delete()
+        _danh_dau_tinh_lai_goi_y([p.id])
         db.session.delete(p)
         db.session.commit()
         return jsonify({"status": "success"})
     except Exception as e:
         db.session.rollback()
-        print('[admin_deletesanpham] Exception:', e)
+        app.logger.exception("admin_deletesanpham failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 
@@ -736,13 +2018,26 @@ def admin_nhapkho():
     kho_id = data.get("kho_id")
     sanpham_id = data.get("sanpham_id")
     so_luong = data.get("so_luong")
+    gia_nhap = data.get("gia_nhap")
 
     if not kho_id or not sanpham_id or not so_luong:
         return jsonify({"message": "Thiếu dữ liệu nhập kho"}), 400
 
+    try:
+        so_luong = int(so_luong)
+    except (TypeError, ValueError):
+        return jsonify({"message": "Số lượng không hợp lệ"}), 400
     if so_luong <= 0:
         return jsonify({"message": "Số lượng phải lớn hơn 0"}), 400
 
+    if gia_nhap is not None:
+        try:
+            gia_nhap = float(gia_nhap)
+        except (TypeError, ValueError):
+            return jsonify({"message": "Giá nhập không hợp lệ"}), 400
+        if not math.isfinite(gia_nhap) or gia_nhap < 0:
+            return jsonify({"message": "Giá nhập không hợp lệ"}), 400
+
     kho = Kho.query.get(kho_id)
     if not kho:
         return jsonify({"message": "Kho không tồn tại"}), 404
@@ -754,26 +2049,33 @@ def admin_nhapkho():
     # ✅ Lưu lịch sử nhập kho
     nhapkho = NhapKho(
         kho_id=kho_id,
-        sanpham_id=sanpham_id,
-        so_luong=so_luong
+        product_id=sanpham_id,
+        so_luong=so_luong,
+        # Chưa có giá nhập thì tạm lấy giá bán để giá vốn không bị bỏ trống
+        gia_nhap=gia_nhap if gia_nhap is not None else sanpham.price,
+        created_at=datetime.utcnow()
     )
 
-    # ✅ Cộng tồn kho sản phẩm
-    sanpham.so_luong += so_luong
+    # ✅ Cộng tồn kho sản phẩm (nguyên tử, không ghi đè lượng vừa bị checkout trừ)
+    Product.query.filter(Product.id == sanpham.id).update(
+        {Product.stock: Product.stock + so_luong}, synchronize_session=False
+    )
 
     db.session.add(nhapkho)
+    _ghi_nhan_nhap_kho(nhapkho)
     db.session.commit()
 
     return jsonify({
         "message": "Nhập kho thành công",
         "data": {
             "kho": kho.ten_kho,
-            "sanpham": sanpham.ten_sanpham,
+            "sanpham": sanpham.name,
             "so_luong": so_luong
         }
     }), 200
 
 @app.route('/api/pageshop', methods=['GET'])
+@db_route("read")
 def get_pageshop():
     shop_id = request.args.get('shop_id')
     if not shop_id:
@@ -790,17 +2092,18 @@ def get_pageshop():
         # For now return empty products list; can be extended
         return jsonify({"status": "success", "shop": shop.to_dict(), "products": []})
     except Exception as e:
-        print("[get_pageshop] Exception:", e)
+        app.logger.exception("get_pageshop failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 
 @app.route('/api/feedbackofshop/<int:shop_id>', methods=['GET'])
+@db_route("read")
 def feedback_of_shop(shop_id):
     try:
         feedbacks = Feedback.query.filter_by(shop_id=shop_id).order_by(Feedback.created_at.desc()).all()
         return jsonify({"status": "success", "feedbacks": [f.to_dict() for f in feedbacks]})
     except Exception as e:
-        print('[feedback_of_shop] Exception:', e)
+        app.logger.exception("feedback_of_shop failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 
@@ -816,18 +2119,618 @@ def create_feedback():
             shop_id=int(shop_id),
             user_id=data.get('user_id'),
             rating=data.get('rating'),
-            comment=data.get('comment')
+            comment=data.get('comment'),
+            created_at=datetime.utcnow()
         )
         db.session.add(fb)
+        _ghi_nhan_feedback(fb)
         db.session.commit()
         return jsonify({"status": "success", "feedback": fb.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
-        print('[create_feedback] Exception:', e)
+        app.logger.exception("create_feedback failed")
+        return jsonify({"status": False, "msg": str(e)}), 500
+
+
+# --- ĐƠN HÀNG / GIỮ HÀNG ---
+# Tồn kho chỉ được trừ bằng UPDATE có điều kiện (stock >= so_luong) nên hai
+# request checkout cùng lúc trên một sản phẩm không thể bán quá số lượng.
+# Mỗi giao dịch chỉ chạm vào các dòng cần thiết rồi commit ngay để giữ khoá ngắn.
+
+def _tru_kho(product_id, so_luong):
+    """Trừ kho nguyên tử. Trả về True nếu còn đủ hàng."""
+    updated = Product.query.filter(
+        Product.id == product_id,
+        Product.stock >= so_luong
+    ).update({Product.stock: Product.stock - so_luong}, synchronize_session=False)
+    return updated == 1
+
+
+def _hoan_kho(hoadon_id):
+    """Cộng lại tồn kho cho toàn bộ sản phẩm của hóa đơn."""
+    items = ChiTietHoaDon.query.filter_by(hoadon_id=hoadon_id).order_by(ChiTietHoaDon.product_id).all()
+    for item in items:
+        Product.query.filter(Product.id == item.product_id).update(
+            {Product.stock: Product.stock + item.so_luong}, synchronize_session=False
+        )
+
+
+def _chuyen_trang_thai(hoadon_id, tu_trang_thai, den_trang_thai, chua_het_han=False):
+    """Đổi trạng thái hóa đơn nếu nó vẫn đang ở một trong `tu_trang_thai`.
+
+    Dùng UPDATE có điều kiện để sweeper và người dùng không cùng hoàn kho hai lần.
+    """
+    query = HoaDon.query.filter(
+        HoaDon.id == hoadon_id,
+        HoaDon.trang_thai.in_(tu_trang_thai)
+    )
+    if chua_het_han:
+        query = query.filter(
+            (HoaDon.het_han_giu.is_(None)) | (HoaDon.het_han_giu > datetime.utcnow())
+        )
+    values = {HoaDon.trang_thai: den_trang_thai}
+    if den_trang_thai != TRANG_THAI_CHO_THANH_TOAN:
+        values[HoaDon.het_han_giu] = None
+    return query.update(values, synchronize_session=False) == 1
+
+
+def release_expired_reservations(batch_size=100):
+    """Hủy các hóa đơn chờ thanh toán đã quá hạn giữ hàng và hoàn kho."""
+    now = datetime.utcnow()
+    expired_ids = [
+        row.id for row in HoaDon.query.with_entities(HoaDon.id).filter(
+            HoaDon.trang_thai == TRANG_THAI_CHO_THANH_TOAN,
+            HoaDon.het_han_giu < now
+        ).limit(batch_size).all()
+    ]
+    released = 0
+    for hoadon_id in expired_ids:
+        try:
+            if _chuyen_trang_thai(hoadon_id, (TRANG_THAI_CHO_THANH_TOAN,), TRANG_THAI_DA_HUY):
+                _hoan_kho(hoadon_id)
+                released += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("release_expired_reservations failed", extra={"hoadon_id": hoadon_id})
+    return released
+
+
+def start_reservation_sweeper(interval=None):
+    """Chạy job nền dọn các hóa đơn giữ hàng đã hết hạn."""
+    _start_background_job(
+        "reservation-sweeper",
+        release_expired_reservations,
+        interval or app.config["ORDER_SWEEP_INTERVAL"]
+    )
+
+
+@app.route('/api/checkout', methods=['POST'])
+@jwt_required()
+def checkout():
+    # JSON: { hinh_thuc_thanh_toan, list_sanpham: [{ sanpham_id, so_luong, shop_id, ghi_chu }] }
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": False, "msg": "Dữ liệu đặt hàng phải là object JSON"}), 400
+    hinh_thuc = data.get("hinh_thuc_thanh_toan")
+    list_sanpham = data.get("list_sanpham") or []
+
+    if not hinh_thuc or not list_sanpham:
+        return jsonify({"status": False, "msg": "Thiếu phương thức thanh toán hoặc sản phẩm"}), 400
+    if hinh_thuc not in HINH_THUC_THANH_TOAN:
+        return jsonify({
+            "status": False,
+            "msg": "hinh_thuc_thanh_toan phải là " + ", ".join(HINH_THUC_THANH_TOAN)
+        }), 400
+    if not isinstance(list_sanpham, list) or not all(isinstance(sp, dict) for sp in list_sanpham):
+        return jsonify({"status": False, "msg": "list_sanpham phải là danh sách object"}), 400
+
+    # Gộp số lượng theo sản phẩm
+    so_luong_theo_sp = {}
+    ghi_chu_theo_shop = {}
+    for sp in list_sanpham:
+        try:
+            sp_id = int(sp.get("sanpham_id"))
+            so_luong = int(sp.get("so_luong"))
+        except (TypeError, ValueError):
+            return jsonify({"status": False, "msg": "Dữ liệu sản phẩm không hợp lệ"}), 400
+        if so_luong <= 0:
+            return jsonify({"status": False, "msg": "Số lượng phải lớn hơn 0"}), 400
+        so_luong_theo_sp[sp_id] = so_luong_theo_sp.get(sp_id, 0) + so_luong
+        if sp.get("ghi_chu"):
+            ghi_chu_theo_shop[sp.get("shop_id")] = sp.get("ghi_chu")
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(so_luong_theo_sp.keys())).all()}
+    missing = [sp_id for sp_id in so_luong_theo_sp if sp_id not in products]
+    if missing:
+        return jsonify({"status": False, "msg": "Sản phẩm không tồn tại", "sanpham_id": missing}), 404
+
+    giu_hang = hinh_thuc != "cod"
+    het_han = datetime.utcnow() + app.config["ORDER_RESERVATION_TTL"] if giu_hang else None
+    trang_thai = TRANG_THAI_CHO_THANH_TOAN if giu_hang else TRANG_THAI_CHO_XU_LY
+
+    try:
+        # Trừ kho theo thứ tự id để các giao dịch đồng thời luôn khoá theo cùng thứ tự
+        for sp_id in sorted(so_luong_theo_sp):
+            if not _tru_kho(sp_id, so_luong_theo_sp[sp_id]):
+                db.session.rollback()
+                return jsonify({
+                    "status": False,
+                    "msg": f"Sản phẩm '{products[sp_id].name}' không đủ hàng",
+                    "sanpham_id": sp_id
+                }), 409
+
+        # Mỗi shop một hóa đơn
+        hoadons = {}
+        for sp_id, so_luong in so_luong_theo_sp.items():
+            product = products[sp_id]
+            hd = hoadons.get(product.shop_id)
+            if hd is None:
+                hd = HoaDon(
+                    user_id=user_id,
+                    shop_id=product.shop_id,
+                    hinh_thuc_thanh_toan=hinh_thuc,
+                    trang_thai=trang_thai,
+                    ghi_chu=ghi_chu_theo_shop.get(product.shop_id) or ghi_chu_theo_shop.get(str(product.shop_id)),
+                    het_han_giu=het_han
+                )
+                hoadons[product.shop_id] = hd
+                db.session.add(hd)
+            don_gia = product.discount_price if product.is_discounted and product.discount_price else product.price
+            hd.items.append(ChiTietHoaDon(product_id=sp_id, so_luong=so_luong, don_gia=don_gia))
+            hd.tong_tien = (hd.tong_tien or 0) + don_gia * so_luong
+            hd.giam_gia_tong_hd = (hd.giam_gia_tong_hd or 0) + (product.price - don_gia) * so_luong
+
+        # Lượt mua mới làm thay đổi độ tương tự theo hành vi
+        _danh_dau_tinh_lai_goi_y(so_luong_theo_sp)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("checkout failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
+    for sp_id, so_luong in so_luong_theo_sp.items():
+        ghi_nhan_tuong_tac(sp_id, luot_mua=so_luong)
+
+    return jsonify({
+        "status": "success",
+        "msg": "Đặt hàng thành công",
+        "hoadons": [hd.to_dict() for hd in hoadons.values()]
+    }), 201
+
+
+@app.route('/api/getallbill', methods=['GET'])
+@jwt_required()
+def get_all_bill():
+    user_id = int(get_jwt_identity())
+    hoadons = HoaDon.query.filter_by(user_id=user_id).order_by(HoaDon.ngay_lap.desc()).all()
+    return jsonify({"status": "success", "data": [hd.to_dict() for hd in hoadons]})
+
+
+@app.route('/api/getallbillshop', methods=['GET'])
+@jwt_required()
+def get_all_bill_shop():
+    user_id = int(get_jwt_identity())
+    shop = Shop.query.filter_by(user_id=user_id).first()
+    if not shop:
+        return jsonify({"msg": "Bạn chưa tạo shop"}), 403
+    hoadons = HoaDon.query.filter_by(shop_id=shop.id).order_by(HoaDon.ngay_lap.desc()).all()
+    return jsonify({"status": "success", "data": [hd.to_dict() for hd in hoadons]})
+
+
+@app.route('/api/getBillDetail/<int:hoadon_id>', methods=['GET'])
+@jwt_required()
+def get_bill_detail(hoadon_id):
+    user_id = int(get_jwt_identity())
+    hd = HoaDon.query.get(hoadon_id)
+    if not hd:
+        return jsonify({"status": False, "msg": "Hóa đơn không tồn tại"}), 404
+    shop = Shop.query.get(hd.shop_id) if hd.shop_id else None
+    if hd.user_id != user_id and not (shop and shop.user_id == user_id):
+        return jsonify({"status": False, "msg": "Không có quyền xem hóa đơn này"}), 403
+    return jsonify({
+        "status": "success",
+        "hoadon": hd.to_dict(),
+        "items": [item.to_dict() for item in hd.items]
+    })
+
+
+@app.route('/api/updatebill', methods=['PUT'])
+@jwt_required()
+def update_bill():
+    # JSON: { hoadon_id, trang_thai }
+    user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": False, "msg": "Dữ liệu phải là object JSON"}), 400
+    hoadon_id = data.get("hoadon_id")
+    trang_thai = data.get("trang_thai")
+    if not hoadon_id or not trang_thai:
+        return jsonify({"status": False, "msg": "Thiếu hoadon_id hoặc trang_thai"}), 400
+
+    hd = HoaDon.query.get(hoadon_id)
+    if not hd:
+        return jsonify({"status": False, "msg": "Hóa đơn không tồn tại"}), 404
+    if trang_thai not in CHUYEN_TRANG_THAI:
+        return jsonify({"status": False, "msg": "Trạng thái không hợp lệ"}), 400
+
+    shop = Shop.query.get(hd.shop_id) if hd.shop_id else None
+    user = User.query.get(user_id)
+    duoc_phep = set()
+    if (shop and shop.user_id == user_id) or (user and user.is_admin):
+        duoc_phep |= QUYEN_CHUYEN_TRANG_THAI["shop"]
+    if hd.user_id == user_id:
+        duoc_phep |= QUYEN_CHUYEN_TRANG_THAI["khach"]
+    if trang_thai not in duoc_phep:
+        return jsonify({"status": False, "msg": "Không có quyền chuyển hóa đơn sang trạng thái này"}), 403
+
+    try:
+        # Xác nhận thanh toán (-> chờ xử lý) chỉ hợp lệ khi hàng còn đang được giữ
+        ok = _chuyen_trang_thai(
+            hd.id, CHUYEN_TRANG_THAI[trang_thai], trang_thai,
+            chua_het_han=(trang_thai == TRANG_THAI_CHO_XU_LY)
+        )
+        if ok and trang_thai == TRANG_THAI_DA_HUY:
+            _hoan_kho(hd.id)
+        if not ok:
+            db.session.rollback()
+            return jsonify({"status": False, "msg": "Không thể chuyển trạng thái hóa đơn"}), 409
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("update_bill failed")
+        return jsonify({"status": False, "msg": str(e)}), 500
+
+    db.session.refresh(hd)
+    return jsonify({"status": "success", "hoadon": hd.to_dict()})
+
+
+# --- ÁP DỤNG KHUYẾN MÃI ---
+# Giá hiệu lực được tính sẵn và ghi vào product.discount_price / is_discounted,
+# nên các API danh sách và checkout chỉ đọc cột của product, không xét luật khuyến mãi.
+# Scheduler chỉ tìm các khuyến mãi vừa tới giờ bắt đầu / kết thúc (qua index
+# da_kich_hoat + ket_thuc), rồi tính lại giá cho đúng các sản phẩm chúng chạm tới.
+
+def _san_pham_cua_khuyen_mai(km):
+    """id các sản phẩm thuộc phạm vi của một khuyến mãi."""
+    if km.pham_vi == "san_pham":
+        return {km.doi_tuong_id}
+    column = Product.category_id if km.pham_vi == "danh_muc" else Product.shop_id
+    return {row.id for row in Product.query.with_entities(Product.id).filter(column == km.doi_tuong_id)}
+
+
+def _ap_dung_khuyen_mai(product_ids, now=None):
+    """Tính lại giá hiệu lực cho `product_ids` theo các khuyến mãi đang chạy, ghi theo lô.
+
+    Giá hiệu lực là giá thấp nhất giữa các khuyến mãi đang chạy và giá giảm nhập tay.
+    Trả về số sản phẩm đã đổi giá.
+    """
+    now = now or datetime.utcnow()
+    dang_chay = KhuyenMai.query.filter(KhuyenMai.bat_dau <= now, KhuyenMai.ket_thuc > now).all()
+    theo_pham_vi = {(km.pham_vi, km.doi_tuong_id): [] for km in dang_chay}
+    for km in dang_chay:
+        theo_pham_vi[(km.pham_vi, km.doi_tuong_id)].append(km)
+
+    product_ids = sorted(set(product_ids))
+    batch_size = app.config["PROMOTION_BATCH_SIZE"]
+    changed = 0
+    for i in range(0, len(product_ids), batch_size):
+        chunk = product_ids[i:i + batch_size]
+        saved = {g.product_id: g for g in GiaTruocKhuyenMai.query.filter(GiaTruocKhuyenMai.product_id.in_(chunk))}
+        updates = []
+        for row in Product.query.with_entities(
+            Product.id, Product.price, Product.category_id, Product.shop_id,
+            Product.discount_price, Product.is_discounted
+        ).filter(Product.id.in_(chunk)):
+            kms = (theo_pham_vi.get(("san_pham", row.id), [])
+                   + theo_pham_vi.get(("danh_muc", row.category_id), [])
+                   + theo_pham_vi.get(("shop", row.shop_id), []))
+            goc = saved.get(row.id)
+            if kms:
+                if goc is None:
+                    # Lần đầu có khuyến mãi: giữ lại giá giảm nhập tay để khôi phục sau
+                    goc = GiaTruocKhuyenMai(product_id=row.id, discount_price=row.discount_price,
+                                            is_discounted=row.is_discounted)
+                    db.session.add(goc)
+                gia = min(km.gia_sau_giam(row.price) for km in kms)
+                if goc.is_discounted and goc.discount_price:
+                    gia = min(gia, goc.discount_price)
+                moi = (round(gia, 2), gia < row.price)
+            elif goc is not None:
+                moi = (goc.discount_price, bool(goc.is_discounted))
+                db.session.delete(goc)
+            else:
+                continue
+            if moi != (row.discount_price, bool(row.is_discounted)):
+                updates.append({"id": row.id, "discount_price": moi[0], "is_discounted": moi[1]})
+        if updates:
+            db.session.execute(update(Product), updates)
+        db.session.commit()
+        changed += len(updates)
+    return changed
+
+
+def apply_scheduled_promotions(now=None):
+    """Kích hoạt khuyến mãi tới giờ bắt đầu, gỡ khuyến mãi hết hạn."""
+    now = now or datetime.utcnow()
+    bat = KhuyenMai.query.filter(
+        KhuyenMai.da_kich_hoat.is_(False),
+        KhuyenMai.ket_thuc > now,
+        KhuyenMai.bat_dau <= now
+    ).all()
+    tat = KhuyenMai.query.filter(
+        KhuyenMai.da_kich_hoat.is_(True),
+        (KhuyenMai.ket_thuc <= now) | (KhuyenMai.bat_dau > now)
+    ).all()
+    if not bat and not tat:
+        return None
+    product_ids = set()
+    for km in bat + tat:
+        product_ids |= _san_pham_cua_khuyen_mai(km)
+    changed = _ap_dung_khuyen_mai(product_ids, now)
+    # Đổi cờ sau cùng: nếu lỗi giữa chừng, lượt sau sẽ tính lại các sản phẩm này
+    ids_bat = [km.id for km in bat]
+    ids_tat = [km.id for km in tat]
+    if ids_bat:
+        KhuyenMai.query.filter(KhuyenMai.id.in_(ids_bat)).update(
+            {KhuyenMai.da_kich_hoat: True}, synchronize_session=False)
+    if ids_tat:
+        KhuyenMai.query.filter(KhuyenMai.id.in_(ids_tat)).update(
+            {KhuyenMai.da_kich_hoat: False}, synchronize_session=False)
+    db.session.commit()
+    return f"bật {len(ids_bat)}, tắt {len(ids_tat)} khuyến mãi, đổi giá {changed} sản phẩm"
+
+
+def start_promotion_scheduler(interval=None):
+    """Chạy job nền bật/tắt khuyến mãi theo thời gian."""
+    _start_background_job(
+        "promotion-scheduler",
+        apply_scheduled_promotions,
+        interval or app.config["PROMOTION_TICK_INTERVAL"]
+    )
+
+
+def _doc_khuyen_mai(data, km=None):
+    """Kiểm tra dữ liệu khuyến mãi từ request. Trả về (dict giá trị, lỗi hoặc None)."""
+    if not isinstance(data, dict):
+        return None, "Dữ liệu khuyến mãi phải là object JSON"
+    values = {}
+    for key in ("ten", "pham_vi", "doi_tuong_id", "kieu_giam", "gia_tri", "bat_dau", "ket_thuc"):
+        if key in data:
+            values[key] = data[key]
+        elif km is not None:
+            values[key] = getattr(km, key)
+        else:
+            return None, f"Thiếu {key}"
+    try:
+        values["doi_tuong_id"] = int(values["doi_tuong_id"])
+        values["gia_tri"] = float(values["gia_tri"])
+        for key in ("bat_dau", "ket_thuc"):
+            if isinstance(values[key], str):
+                value = datetime.fromisoformat(values[key])
+                if value.tzinfo is not None:
+                    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+                values[key] = value
+            elif not isinstance(values[key], datetime):  # chỉ giá trị cũ của `km` là datetime
+                raise TypeError(key)
+    except (TypeError, ValueError):
+        return None, "doi_tuong_id, gia_tri, bat_dau hoặc ket_thuc không hợp lệ"
+    if not math.isfinite(values["gia_tri"]):
+        return None, "gia_tri không hợp lệ"
+
+    if values["pham_vi"] not in PHAM_VI_KHUYEN_MAI:
+        return None, "pham_vi phải là " + ", ".join(PHAM_VI_KHUYEN_MAI)
+    if values["kieu_giam"] not in KIEU_GIAM:
+        return None, "kieu_giam phải là " + ", ".join(KIEU_GIAM)
+    if values["gia_tri"] <= 0 or (values["kieu_giam"] == "phan_tram" and values["gia_tri"] > 100):
+        return None, "gia_tri không hợp lệ"
+    if values["ket_thuc"] <= values["bat_dau"]:
+        return None, "ket_thuc phải sau bat_dau"
+    model = {"san_pham": Product, "danh_muc": Category, "shop": Shop}[values["pham_vi"]]
+    if not db.session.get(model, values["doi_tuong_id"]):
+        return None, "Không tìm thấy đối tượng khuyến mãi"
+    return values, None
+
+
+@app.route('/api/admin/khuyenmai', methods=['GET'])
+@admin_required()
+def admin_xem_khuyen_mai():
+    query = KhuyenMai.query
+    if request.args.get('dang_chay'):
+        now = datetime.utcnow()
+        query = query.filter(KhuyenMai.bat_dau <= now, KhuyenMai.ket_thuc > now)
+    danh_sach = query.order_by(KhuyenMai.bat_dau.desc()).all()
+    return jsonify({"status": "success", "khuyen_mai": [km.to_dict() for km in danh_sach]})
+
+
+@app.route('/api/admin/khuyenmai', methods=['POST'])
+@admin_required()
+def admin_tao_khuyen_mai():
+    values, error = _doc_khuyen_mai(request.get_json() or {})
+    if error:
+        return jsonify({"status": False, "msg": error}), 400
+    km = KhuyenMai(**values)
+    db.session.add(km)
+    db.session.commit()
+    # Khuyến mãi bắt đầu ngay thì áp dụng luôn, không chờ lượt scheduler kế tiếp
+    apply_scheduled_promotions()
+    return jsonify({"status": "success", "khuyen_mai": db.session.get(KhuyenMai, km.id).to_dict()}), 201
+
+
+@app.route('/api/admin/khuyenmai/<int:km_id>', methods=['PUT'])
+@admin_required()
+def admin_sua_khuyen_mai(km_id):
+    km = db.session.get(KhuyenMai, km_id)
+    if not km:
+        return jsonify({"status": False, "msg": "Không tìm thấy khuyến mãi"}), 404
+    values, error = _doc_khuyen_mai(request.get_json() or {}, km)
+    if error:
+        return jsonify({"status": False, "msg": error}), 400
+    product_ids = _san_pham_cua_khuyen_mai(km) if km.da_kich_hoat else set()
+    for key, value in values.items():
+        setattr(km, key, value)
+    db.session.commit()
+    # Tính lại cả phạm vi cũ lẫn mới, rồi để scheduler cập nhật cờ nếu thời gian đã đổi
+    now = datetime.utcnow()
+    if km.bat_dau <= now < km.ket_thuc:
+        product_ids |= _san_pham_cua_khuyen_mai(km)
+    _ap_dung_khuyen_mai(product_ids, now)
+    apply_scheduled_promotions(now)
+    return jsonify({"status": "success", "khuyen_mai": db.session.get(KhuyenMai, km_id).to_dict()})
+
+
+@app.route('/api/admin/khuyenmai/<int:km_id>', methods=['DELETE'])
+@admin_required()
+def admin_xoa_khuyen_mai(km_id):
+    km = db.session.get(KhuyenMai, km_id)
+    if not km:
+        return jsonify({"status": False, "msg": "Không tìm thấy khuyến mãi"}), 404
+    product_ids = _san_pham_cua_khuyen_mai(km) if km.da_kich_hoat else set()
+    db.session.delete(km)
+    db.session.commit()
+    _ap_dung_khuyen_mai(product_ids)
+    return jsonify({"status": "success"})
+
+
+# --- THỐNG KÊ ---
+# Chỉ đọc các bảng rollup (xem phần "CẬP NHẬT THỐNG KÊ"), không quét nhap_kho / feedback.
+
+def _khoang_ngay():
+    """Đọc startDate/endDate (YYYY-MM-DD) từ query string. Mặc định 30 ngày gần nhất."""
+    end = request.args.get('endDate')
+    start = request.args.get('startDate')
+    end_date = date.fromisoformat(end) if end else datetime.utcnow().date()
+    start_date = date.fromisoformat(start) if start else end_date - timedelta(days=30)
+    return start_date, end_date
+
+
+def _shop_duoc_xem():
+    """Admin xem được mọi shop (hoặc tất cả nếu không truyền shop_id); chủ shop chỉ xem shop mình.
+
+    Trả về (shop_id hoặc None, lỗi hoặc None).
+    """
+    user = User.query.get(int(get_jwt_identity()))
+    if not user:
+        return None, (jsonify({"msg": "User not found"}), 404)
+    shop_id = request.args.get('shop_id', type=int)
+    if user.is_admin:
+        return shop_id, None
+    if not user.shop or (shop_id and shop_id != user.shop.id):
+        return None, (jsonify({"msg": "Không có quyền xem thống kê shop này"}), 403)
+    return user.shop.id, None
+
+
+@app.route('/api/thongke/giatrikho', methods=['GET'])
+@jwt_required()
+def thongke_gia_tri_kho():
+    """Giá trị tồn kho theo giá vốn bình quân gia quyền (từ NhapKho)."""
+    shop_id, error = _shop_duoc_xem()
+    if error:
+        return error
+
+    query = db.session.query(Product, GiaVonSanPham).outerjoin(
+        GiaVonSanPham, GiaVonSanPham.product_id == Product.id
+    )
+    if shop_id:
+        query = query.filter(Product.shop_id == shop_id)
+
+    items = []
+    tong_gia_tri = 0.0
+    for product, gia_von in query.all():
+        gia_von_tb = gia_von.gia_von_tb if gia_von else None
+        gia_tri = (product.stock or 0) * gia_von_tb if gia_von_tb is not None else None
+        tong_gia_tri += gia_tri or 0.0
+        items.append({
+            "sanpham_id": product.id,
+            "ten_sanpham": product.name,
+            "ton_kho": product.stock,
+            "gia_von_tb": gia_von_tb,
+            "gia_tri": gia_tri,
+        })
+    return jsonify({"status": "success", "shop_id": shop_id, "tong_gia_tri": tong_gia_tri, "data": items})
+
+
+@app.route('/api/thongke/nhapkho', methods=['GET'])
+@admin_required()
+def thongke_nhap_kho():
+    """Số lượng / giá trị nhập theo kho theo ngày."""
+    try:
+        start_date, end_date = _khoang_ngay()
+    except ValueError:
+        return jsonify({"msg": "Ngày không hợp lệ (YYYY-MM-DD)"}), 400
+
+    query = ThongKeNhapKhoNgay.query.filter(
+        ThongKeNhapKhoNgay.ngay >= start_date,
+        ThongKeNhapKhoNgay.ngay <= end_date
+    )
+    kho_id = request.args.get('kho_id', type=int)
+    if kho_id:
+        query = query.filter(ThongKeNhapKhoNgay.kho_id == kho_id)
+    rows = query.order_by(ThongKeNhapKhoNgay.ngay, ThongKeNhapKhoNgay.kho_id).all()
+    return jsonify({"status": "success", "data": [r.to_dict() for r in rows]})
+
+
+@app.route('/api/thongke/sanpham', methods=['GET'])
+@jwt_required()
+def thongke_san_pham():
+    """Số sản phẩm theo shop và danh mục."""
+    shop_id, error = _shop_duoc_xem()
+    if error:
+        return error
+
+    query = ThongKeSanPham.query.filter(ThongKeSanPham.so_san_pham > 0)
+    if shop_id:
+        query = query.filter(ThongKeSanPham.shop_id == shop_id)
+    rows = query.order_by(ThongKeSanPham.shop_id, ThongKeSanPham.category_id).all()
+    return jsonify({"status": "success", "data": [r.to_dict() for r in rows]})
+
+
+@app.route('/api/thongke/feedback/<int:shop_id>', methods=['GET'])
+def thongke_feedback(shop_id):
+    """Xu hướng đánh giá của shop theo ngày."""
+    try:
+        start_date, end_date = _khoang_ngay()
+    except ValueError:
+        return jsonify({"msg": "Ngày không hợp lệ (YYYY-MM-DD)"}), 400
+
+    rows = ThongKeFeedbackNgay.query.filter(
+        ThongKeFeedbackNgay.shop_id == shop_id,
+        ThongKeFeedbackNgay.ngay >= start_date,
+        ThongKeFeedbackNgay.ngay <= end_date
+    ).order_by(ThongKeFeedbackNgay.ngay).all()
+    return jsonify({"status": "success", "data": [r.to_dict() for r in rows]})
+
 # ... (Logic phục vụ Frontend tĩnh)
 
+# --- PROFILER ---
+# Xem profile đã ghi bởi profiler.py. ?format=speedscope tải file mở bằng speedscope.app,
+# ?format=folded trả stack gộp cho flamegraph.pl.
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@admin_required()
+def admin_profiles():
+    return jsonify({"status": "success", "profiles": profiler.list_profiles(app.config["PROFILER_DIR"])})
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@admin_required()
+def admin_profile(profile_id):
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'speedscope', 'folded'):
+        return jsonify({"status": False, "msg": "format phải là json, speedscope hoặc folded"}), 400
+    path = profiler.profile_path(app.config["PROFILER_DIR"], profile_id, speedscope=fmt != 'json')
+    if not path:
+        return jsonify({"status": False, "msg": "Profile not found"}), 404
+    if fmt == 'speedscope':
+        return send_file(path, mimetype="application/json", as_attachment=True,
+                         download_name=f"{profile_id}.speedscope.json")
+    with open(path) as f:
+        data = json.load(f)
+    if fmt == 'folded':
+        return Response(profiler.to_folded(data), mimetype="text/plain")
+    return jsonify({"status": "success", "profile": data})
+
 # --- PHỤC VỤ FRONTEND TĨNH (STATIC FILE SERVER) ---
 
 # Tuyến đường phục vụ tệp index.html và các đường dẫn con của React Router
@@ -845,27 +2748,23 @@ def serve(path):
         return send_from_directory(static_folder, 'index.html')
     
 @app.route('/api/auth/refresh-token', methods=['POST'])
-@jwt_required()
+@jwt_required(refresh=True)
 def refresh_token():
-    # Debug incoming cookies/headers to diagnose missing cookie issues
-    try:
-        print("[refresh_token] Incoming Cookies:", request.cookies)
-        print("[refresh_token] Incoming Headers (Origin, Cookie):", request.headers.get('Origin'), request.headers.get('Cookie'))
-    except Exception:
-        pass
-
-    # Lấy định danh người dùng từ token hiện tại
+    # Lấy định danh người dùng từ refresh token hiện tại
     current_user_id = get_jwt_identity()
     # Create new token; ensure identity is a string
     new_access_token = create_access_token(identity=str(current_user_id))
+    # Xoay vòng: refresh token cũ bị thu hồi, cấp refresh token mới
+    new_refresh_token = create_refresh_token(identity=str(current_user_id))
     
     # Trả về thông tin user kèm token mới để frontend cập nhật state
     try:
-        try:
-            user_id_int = int(current_user_id)
-        except Exception:
-            user_id_int = current_user_id
-        user = User.query.get(user_id_int)
+        revoke_token(get_jwt())
+        db.session.commit()
+        app.logger.debug("refresh token rotated", extra={"user_id": current_user_id})
+
+        # User + shop trong một truy vấn
+        user = User.query.options(joinedload(User.shop)).filter_by(id=int(current_user_id)).first()
         response = jsonify({
             "status": True,
             "msg": "Token đã được làm mới",
@@ -873,15 +2772,17 @@ def refresh_token():
             "accessToken": new_access_token,
         })
         set_access_cookies(response, new_access_token)
+        set_refresh_cookies(response, new_refresh_token)
         return response
     except Exception as e:
-        print("[refresh_token] Exception:", e)
+        db.session.rollback()
+        app.logger.exception("refresh_token failed")
         return jsonify({"status": False, "msg": str(e)}), 500
 
 
 # Backwards-compatible alias for older frontend paths
 @app.route('/refresh-token', methods=['POST'])
-@jwt_required()
+@jwt_required(refresh=True)
 def refresh_token_alias():
     return refresh_token()
 
@@ -890,6 +2791,13 @@ def refresh_token_alias():
 if __name__ == '__main__':
     # Bắt đầu khởi tạo database và dữ liệu mẫu
     initialize_database() 
+    # Job nền hủy các đơn giữ hàng quá hạn
+    start_reservation_sweeper()
+    start_analytics_compactor()
+    start_popularity_flusher()
+    start_revocation_sync()
+    start_upload_cleaner()
+    start_promotion_scheduler()
     
     print("\n=============================================")
     print(f"Backend Python (Flask) đang chạy trên: http://localhost:5000")
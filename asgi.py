@@ -0,0 +1,213 @@
+# asgi.py
+# Chế độ phục vụ bất đồng bộ (ASGI) cho các API đọc công khai của catalog.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 2
+#
+# Dùng chung model với app.py nhưng truy vấn qua async SQLAlchemy (aiosqlite),
+# nên một worker phục vụ được hàng trăm kết nối đồng thời thay vì một request
+# mỗi thread. Reverse proxy chuyển các route dưới đây sang cổng ASGI, phần còn
+# lại (ghi, admin, đăng nhập) vẫn do app.py (WSGI) xử lý.
+import asyncio
+import logging
+import os
+
+from quart import Quart, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from flask_jwt_extended import decode_token
+
+import app as wsgi
+import logging_setup
+from app import Category, Product, Shop, Feedback
+
+# Driver async tương ứng với driver đồng bộ trong SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+app = Quart(__name__)
+logger = logging.getLogger("cuahang.asgi")
+
+
+def _async_database_url():
+    """URL async: ưu tiên biến môi trường ASYNC_DATABASE_URL, nếu không thì suy ra từ app.py.
+
+    Mọi route ở đây chỉ đọc, nên dùng engine "doc" (SQLite mode=ro hoặc replica).
+    """
+    if os.environ.get("ASYNC_DATABASE_URL"):
+        return os.environ["ASYNC_DATABASE_URL"]
+    with wsgi.app.app_context():
+        # url đã được Flask-SQLAlchemy đổi sqlite tương đối thành đường dẫn trong instance/
+        url = wsgi.db.engines["doc"].url
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+_database_url = make_url(_async_database_url())
+engine = create_async_engine(
+    _database_url,
+    # Giống app.py: chờ khoá thay vì lỗi "database is locked" ngay
+    connect_args={"timeout": 15} if _database_url.get_backend_name() == "sqlite" else {},
+)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+@app.before_serving
+async def startup():
+    # Dùng lại job nền của app.py: đồng bộ token bị thu hồi và ghi lượt xem theo lô
+    def start_jobs():
+        with wsgi.app.app_context():
+            wsgi.sync_revoked_tokens()
+        wsgi.start_revocation_sync()
+        wsgi.start_popularity_flusher()
+
+    await asyncio.to_thread(start_jobs)
+
+
+@app.before_request
+async def log_begin_request():
+    # Hook async: contextvar phải được đặt trong task của request, không phải trong thread phụ
+    logging_setup.begin_request(
+        request.url_rule.rule if request.url_rule else None,
+        request.headers.get(logging_setup.REQUEST_ID_HEADER)
+    )
+
+
+@app.after_request
+async def log_end_request(response):
+    request_id = logging_setup.current_request_id()
+    if request_id:
+        response.headers[logging_setup.REQUEST_ID_HEADER] = request_id
+    logging_setup.end_request(request.method, request.path, response.status_code)
+    return response
+
+
+@app.after_serving
+async def shutdown():
+    await engine.dispose()
+
+
+def _current_user_id():
+    """user_id từ access token cookie (nếu hợp lệ và chưa bị thu hồi), ngược lại None."""
+    token = request.cookies.get(wsgi.app.config["JWT_ACCESS_COOKIE_NAME"])
+    if not token:
+        return None
+    try:
+        with wsgi.app.app_context():
+            payload = decode_token(token)
+            if wsgi.is_token_revoked(payload["jti"]):
+                return None
+    except Exception:
+        return None
+    return int(payload["sub"])
+
+
+@app.route('/api/categories', methods=['GET'])
+async def get_categories():
+    """Lấy danh sách các danh mục."""
+    async with Session() as session:
+        categories = (await session.scalars(select(Category))).all()
+    return jsonify([c.to_dict() for c in categories])
+
+
+@app.route('/api/products/discount', methods=['GET'])
+async def get_discount_products():
+    """Lấy danh sách sản phẩm giảm giá."""
+    async with Session() as session:
+        products = (await session.scalars(select(Product).filter_by(is_discounted=True))).all()
+    url_root = request.url_root
+    return jsonify({
+        "title": "Sản phẩm giảm giá",
+        "products": [p.to_dict(url_root) for p in products]
+    })
+
+
+@app.route('/api/products/bestseller', methods=['GET'])
+async def get_bestseller_products():
+    """Lấy danh sách sản phẩm bán chạy nhất."""
+    async with Session() as session:
+        products = (await session.scalars(wsgi.truy_van_ban_chay(wsgi.app.config["BESTSELLER_LIMIT"]))).all()
+        if not products:
+            products = (await session.scalars(wsgi.truy_van_ban_chay_dat_tay())).all()
+    url_root = request.url_root
+    return jsonify({
+        "title": "Sản phẩm bán chạy hàng đầu",
+        "products": [p.to_dict(url_root) for p in products]
+    })
+
+
+@app.route('/api/products/suggested', methods=['GET'])
+async def get_suggested_products():
+    """Lấy danh sách sản phẩm gợi ý (giống app.get_suggested_products)."""
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    product_id = request.args.get('product_id', type=int)
+    user_id = _current_user_id()
+
+    async with Session() as session:
+        ids = []
+        if product_id:
+            ids = (await session.scalars(wsgi.truy_van_tuong_tu(product_id, limit))).all()
+        elif user_id:
+            da_mua = (await session.scalars(wsgi.truy_van_da_mua_gan_day(user_id))).all()
+            if da_mua:
+                ids = (await session.scalars(wsgi.truy_van_goi_y_theo_da_mua(da_mua, limit))).all()
+
+        if ids:
+            products = wsgi.sap_theo_ids((await session.scalars(wsgi.truy_van_san_pham_theo_id(ids))).all(), ids)
+        else:
+            products = (await session.scalars(wsgi.truy_van_san_pham_moi())).all()
+
+    url_root = request.url_root
+    return jsonify({
+        "title": "Sản phẩm gợi ý cho bạn",
+        "products": [p.to_dict(url_root) for p in products]
+    })
+
+
+@app.route('/api/products/<int:product_id>', methods=['GET'])
+async def get_product_details(product_id):
+    """Lấy chi tiết một sản phẩm theo ID."""
+    async with Session() as session:
+        product = await session.get(Product, product_id)
+        if not product:
+            return jsonify({"error": "Product not found"}), 404
+        category = await session.get(Category, product.category_id)
+
+    # Đếm lượt xem trong RAM, job nền sẽ ghi theo lô
+    wsgi.ghi_nhan_tuong_tac(product.id, luot_xem=1)
+
+    product_data = product.to_dict(request.url_root)
+    product_data['category'] = category.to_dict() if category else None
+    product_data['description'] = "Đây là mô tả chi tiết của sản phẩm " + product.name + ". Sản phẩm này đang có sẵn hàng."
+    product_data['stock'] = product.stock
+    return jsonify({"product": product_data})
+
+
+@app.route('/api/pageshop', methods=['GET'])
+async def get_pageshop():
+    shop_id = request.args.get('shop_id', type=int)
+    if not shop_id:
+        return jsonify({"status": False, "msg": "shop_id is required"}), 400
+    try:
+        async with Session() as session:
+            shop = await session.get(Shop, shop_id)
+        if not shop:
+            return jsonify({"status": False, "msg": "Shop not found"}), 404
+        return jsonify({"status": "success", "shop": shop.to_dict(), "products": []})
+    except Exception as e:
+        logger.exception("get_pageshop failed")
+        return jsonify({"status": False, "msg": str(e)}), 500
+
+
+@app.route('/api/feedbackofshop/<int:shop_id>', methods=['GET'])
+async def feedback_of_shop(shop_id):
+    try:
+        async with Session() as session:
+            feedbacks = (await session.scalars(
+                select(Feedback).filter_by(shop_id=shop_id).order_by(Feedback.created_at.desc())
+            )).all()
+        return jsonify({"status": "success", "feedbacks": [f.to_dict() for f in feedbacks]})
+    except Exception as e:
+        logger.exception("feedback_of_shop failed")
+        return jsonify({"status": False, "msg": str(e)}), 500
@@ -0,0 +1,146 @@
+# bench_serving.py
+# So sánh khả năng chịu kết nối đồng thời giữa WSGI (gunicorn, app.py) và ASGI (uvicorn, asgi.py).
+#
+#   python bench_serving.py                               # mặc định: 2 worker, 10s mỗi mức
+#   python bench_serving.py --workers 4 --concurrency 10 100 500 --slow-clients 0 100
+#   python bench_serving.py --modes wsgi --worker-class gthread --threads 4
+#
+# Mỗi mức đo: N client liên tục gọi --path trong --duration giây, đồng thời giữ
+# M "client chậm" (gửi header nhỏ giọt, giống mạng di động yếu) chiếm kết nối.
+# Chỉ dùng thư viện chuẩn để không ảnh hưởng tới kết quả.
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+HOST = "127.0.0.1"
+
+
+def _wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((HOST, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server trên cổng {port} không khởi động được")
+
+
+def _start_server(kind, port, workers, wsgi_args=()):
+    if kind == "wsgi":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"{HOST}:{port}", *wsgi_args, "wsgi:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", HOST, "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _wait_for_port(port)
+    return proc
+
+
+async def _get(port, path, timeout):
+    """Một request HTTP/1.1 (Connection: close). Trả về status code."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+        return int(data.split(b" ", 2)[1])
+    finally:
+        writer.close()
+
+
+async def _slow_client(port, stop):
+    """Giữ một kết nối bằng cách gửi header từng chút một cho tới khi `stop`."""
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port)
+        writer.write(f"GET /api/categories HTTP/1.1\r\nHost: {HOST}\r\n".encode())
+        await writer.drain()
+        i = 0
+        while not stop.is_set():
+            writer.write(f"X-Slow-{i}: 1\r\n".encode())
+            await writer.drain()
+            i += 1
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+        writer.close()
+    except (OSError, ConnectionError):
+        pass
+
+
+async def _load(port, path, concurrency, duration, slow_clients, timeout):
+    stop = asyncio.Event()
+    slow = [asyncio.create_task(_slow_client(port, stop)) for _ in range(slow_clients)]
+    await asyncio.sleep(0.5 if slow_clients else 0)
+
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await _get(port, path, timeout)
+                if status != 200:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stop.set()
+    await asyncio.gather(*slow)
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / duration,
+        "p50": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WSGI vs ASGI cho API catalog")
+    parser.add_argument("--path", default="/api/products/discount")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--slow-clients", type=int, nargs="+", default=[0, 50])
+    parser.add_argument("--modes", nargs="+", default=["wsgi", "asgi"], choices=["wsgi", "asgi"])
+    parser.add_argument("--worker-class", default="sync", help="worker class gunicorn cho chế độ wsgi")
+    parser.add_argument("--threads", type=int, default=1, help="số thread mỗi worker (gthread)")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    wsgi_args = ["--worker-class", args.worker_class, "--threads", str(args.threads)]
+    print(f"path={args.path} workers={args.workers} wsgi={args.worker_class}x{args.threads} "
+          f"duration={args.duration}s\n")
+    print("| mode | concurrency | slow clients | req/s | p50 ms | p99 ms | errors |")
+    print("|------|-------------|--------------|-------|--------|--------|--------|")
+    for i, mode in enumerate(args.modes):
+        port = 5600 + i
+        proc = _start_server(mode, port, args.workers, wsgi_args)
+        try:
+            for slow in args.slow_clients:
+                for concurrency in args.concurrency:
+                    r = asyncio.run(_load(port, args.path, concurrency, args.duration, slow, args.timeout))
+                    print(f"| {mode} | {concurrency} | {slow} | {r['rps']:.0f} | {r['p50']:.1f} | "
+                          f"{r['p99']:.1f} | {r['errors']} |", flush=True)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# gunicorn.conf.py
+# Cấu hình gunicorn cho production (gunicorn tự đọc file này khi chạy trong thư mục gốc):
+#
+#   gunicorn wsgi:app                                   # hoặc: python wsgi.py
+#   GUNICORN_WORKER_CLASS=gevent gunicorn wsgi:app
+#
+# Reload không downtime: `kill -HUP $(cat gunicorn.pid)` -> master đọc lại cấu
+# hình, khởi động worker mới với code mới rồi mới tắt dần worker cũ.
+# Mọi giá trị đều ghi đè được bằng biến môi trường hoặc tham số dòng lệnh.
+import fcntl
+import multiprocessing
+import os
+import subprocess
+import sys
+
+cpu = multiprocessing.cpu_count()
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+
+# sync | gthread | gevent — xem README, mục "Chạy production với gunicorn"
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+if worker_class == "gevent":
+    # Một process mỗi CPU; mỗi process giữ hàng trăm kết nối bằng greenlet
+    workers = int(os.environ.get("WEB_CONCURRENCY", cpu))
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+elif worker_class == "gthread":
+    workers = int(os.environ.get("WEB_CONCURRENCY", cpu + 1))
+    threads = int(os.environ.get("GUNICORN_THREADS", 4))
+else:
+    workers = int(os.environ.get("WEB_CONCURRENCY", cpu * 2 + 1))
+
+# Thay worker sau ~1000 request (lệch ngẫu nhiên để không restart cùng lúc) để chặn rò rỉ bộ nhớ
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))  # đứng sau reverse proxy giữ kết nối
+
+# Không preload: HUP khi đó nạp lại cả code của app, không chỉ cấu hình
+preload_app = False
+pidfile = os.environ.get("GUNICORN_PIDFILE", "gunicorn.pid")
+errorlog = "-"
+
+# Job dùng chung chỉ chạy ở một worker (leader): worker nào giữ được file lock
+# LEADER_LOCK thì giữ nó tới khi thoát. Worker khác thử lại mỗi LEADER_RETRY_INTERVAL
+# giây để thay leader khi leader bị restart (max_requests, HUP, crash).
+LEADER_LOCK = os.environ.get("GUNICORN_LEADER_LOCK", "/tmp/cuahang-jobs-leader.lock")
+LEADER_RETRY_INTERVAL = int(os.environ.get("GUNICORN_LEADER_RETRY_INTERVAL", 5))
+
+_leader_lock_file = None  # giữ file mở suốt đời worker: đóng file là nhả lock
+
+
+def on_starting(server):
+    # Tạo bảng / dữ liệu mẫu một lần trước khi fork. Chạy ở process con để
+    # master không import app.py (nếu không HUP sẽ không nạp được code mới).
+    subprocess.run(
+        [sys.executable, "-c", "from app import initialize_database; initialize_database()"],
+        check=True
+    )
+
+
+def _become_leader():
+    """Thử lấy lock leader (không chờ). True nếu worker này đang là leader."""
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+    lock_file = open(LEADER_LOCK, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    _leader_lock_file = lock_file
+    return True
+
+
+def _start_shared_jobs(cuahang):
+    cuahang._start_background_job(
+        "reservation-sweeper",
+        cuahang.release_expired_reservations,
+        cuahang.app.config["ORDER_SWEEP_INTERVAL"]
+    )
+    cuahang._start_background_job(
+        "analytics-compactor",
+        cuahang.rebuild_analytics_rollups,
+        cuahang.app.config["ANALYTICS_COMPACT_INTERVAL"]
+    )
+    cuahang._start_background_job(
+        "upload-cleaner",
+        cuahang.clean_expired_uploads,
+        cuahang.app.config["UPLOAD_CLEAN_INTERVAL"]
+    )
+    cuahang._start_background_job(
+        "promotion-scheduler",
+        cuahang.apply_scheduled_promotions,
+        cuahang.app.config["PROMOTION_TICK_INTERVAL"]
+    )
+
+
+def post_worker_init(worker):
+    # Chạy sau khi worker đã nạp app (và sau monkey-patch nếu dùng gevent)
+    import app as cuahang
+
+    # Không dùng lại kết nối DB kế thừa từ process cha (khi chạy với --preload)
+    with cuahang.app.app_context():
+        for engine in cuahang.db.engines.values():
+            engine.dispose(close=False)
+
+    # Job theo từng worker: bộ đếm lượt xem và danh sách token thu hồi nằm trong RAM của worker
+    cuahang.start_popularity_flusher()
+    cuahang.start_revocation_sync()
+
+    # Job dùng chung: chỉ worker leader chạy
+    if _become_leader():
+        _start_shared_jobs(cuahang)
+        cuahang.app.logger.info("worker %s là leader, chạy job dùng chung", worker.pid)
+        return
+
+    def elect():
+        if _leader_lock_file is None and _become_leader():
+            _start_shared_jobs(cuahang)
+            return f"worker {worker.pid} trở thành leader, chạy job dùng chung"
+        return None
+
+    cuahang._start_background_job("leader-election", elect, LEADER_RETRY_INTERVAL)
+
+
+def worker_exit(server, worker):
+    import app as cuahang
+
+    # Ghi nốt lượt xem còn trong RAM trước khi worker thoát (max_requests, HUP)
+    with cuahang.app.app_context():
+        try:
+            cuahang.flush_popularity_counters()
+        except Exception:
+            cuahang.app.logger.exception("worker_exit: flush popularity counters failed")
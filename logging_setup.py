@@ -0,0 +1,264 @@
+# logging_setup.py
+# Log có cấu trúc (JSON, mỗi dòng một bản ghi) dùng chung cho app.py, asgi.py và gunicorn.
+#
+# - Thread xử lý request chỉ đưa bản ghi vào hàng đợi; một thread riêng
+#   (QueueListener) định dạng và ghi ra stdout, nên request không bao giờ chờ I/O.
+#   Hàng đợi đầy thì bản ghi bị bỏ (và được đếm) thay vì chặn request.
+# - Mỗi request có request_id (lấy từ header X-Request-ID nếu có, ngược lại tự
+#   sinh), được gắn vào mọi bản ghi trong request và trả lại trong response.
+# - Log DEBUG được lấy mẫu theo route: mỗi request quyết định một lần có ghi
+#   DEBUG hay không, theo LOG_DEBUG_SAMPLE_ROUTES / LOG_DEBUG_SAMPLE_RATE.
+# - Cookie, token, mật khẩu bị che trước khi ghi ra.
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+REDACTED = "[REDACTED]"
+
+# Tên trường (trong `extra=`) có giá trị luôn bị che
+SENSITIVE_KEYS = re.compile(r"cookie|token|authorization|password|secret|jwt", re.IGNORECASE)
+# Chuỗi JWT (header.payload.signature) và giá trị cookie/bearer lẫn trong message
+SENSITIVE_PATTERNS = [
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), REDACTED),
+    (re.compile(r"(?i)\b(bearer)\s+[\w.~+/=-]+"), r"\1 " + REDACTED),
+    (re.compile(r"(?i)\b((?:set-)?cookie[\"']?\s*[:=]\s*)[^\n]*"), r"\1" + REDACTED),
+    (re.compile(r"(?i)\b((?:access|refresh)_token_cookie=)[^;\s]+"), r"\1" + REDACTED),
+]
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_REQUEST_ID_VALID = re.compile(r"^[\w.-]{1,64}$")
+
+# Trường chuẩn của LogRecord, không đưa vào JSON như trường `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName", "request_id", "route"}
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_request_route = contextvars.ContextVar("request_route", default=None)
+_debug_sampled = contextvars.ContextVar("debug_sampled", default=None)
+_request_started = contextvars.ContextVar("request_started", default=None)
+
+access_logger = logging.getLogger("cuahang.access")
+
+_listener = None
+_handler = None
+_settings = {"debug_rate": 0.0, "debug_routes": {}, "debug_outside_request": False}
+_lock = threading.Lock()
+
+
+def redact(value):
+    """Che token / cookie trong một chuỗi."""
+    for pattern, repl in SENSITIVE_PATTERNS:
+        value = pattern.sub(repl, value)
+    return value
+
+
+def _redact_field(key, value):
+    if SENSITIVE_KEYS.search(key):
+        return REDACTED
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {k: _redact_field(str(k), v) for k, v in value.items()}
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """Một dòng JSON cho mỗi bản ghi. Chạy trong thread của QueueListener."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+            "func": record.funcName,
+        }
+        for key in ("request_id", "route"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in entry and not key.startswith("_"):
+                entry[key] = _redact_field(key, value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = redact(record.exc_text)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Gắn request_id/route vào bản ghi và lấy mẫu log DEBUG theo request.
+
+    Chạy trong thread gọi log (trước khi vào hàng đợi), nên đọc được contextvar của request.
+    """
+
+    def filter(self, record):
+        if record.levelno < logging.INFO:
+            sampled = _debug_sampled.get()
+            if sampled is None:
+                sampled = _settings["debug_outside_request"]
+            if not sampled:
+                return False
+        record.request_id = _request_id.get()
+        record.route = _request_route.get()
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không chặn: hàng đợi đầy thì bỏ bản ghi và đếm lại."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Chỉ làm phần việc bắt buộc ở thread gọi: ghép message và chuyển traceback
+        # thành chuỗi (traceback không được giữ qua thread). Định dạng JSON và che
+        # dữ liệu nhạy cảm để QueueListener làm.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+def _parse_routes(value):
+    """"/api/checkout=1,/api/products/<int:product_id>=0.01" -> {rule: rate}"""
+    routes = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        rule, _, rate = item.rpartition("=")
+        routes[rule] = float(rate)
+    return routes
+
+
+def configure_logging(config):
+    """Gắn handler JSON qua hàng đợi vào root logger. Gọi lại là no-op.
+
+    `config` là dict kiểu app.config với các khoá LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE,
+    LOG_DEBUG_SAMPLE_ROUTES, LOG_QUEUE_SIZE.
+    """
+    global _listener, _handler
+    with _lock:
+        level = logging.getLevelName(str(config.get("LOG_LEVEL", "INFO")).upper())
+        routes = config.get("LOG_DEBUG_SAMPLE_ROUTES") or {}
+        if isinstance(routes, str):
+            routes = _parse_routes(routes)
+        _settings["debug_rate"] = float(config.get("LOG_DEBUG_SAMPLE_RATE", 0.0))
+        _settings["debug_routes"] = dict(routes)
+        _settings["debug_outside_request"] = level <= logging.DEBUG
+
+        # Logger phải cho DEBUG đi qua nếu có route được lấy mẫu; filter sẽ bỏ phần còn lại
+        wants_debug = level <= logging.DEBUG or _settings["debug_rate"] > 0 or any(routes.values())
+        root = logging.getLogger()
+        root.setLevel(logging.DEBUG if wants_debug else level)
+        # Thư viện ồn ở mức DEBUG chỉ ghi từ INFO trở lên
+        for name in ("werkzeug", "urllib3", "asyncio", "aiosqlite", "PIL"):
+            logging.getLogger(name).setLevel(max(level, logging.INFO))
+
+        if _handler is not None:
+            return
+        log_queue = queue.Queue(int(config.get("LOG_QUEUE_SIZE", 10000)))
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(RequestContextFilter())
+        root.addHandler(_handler)
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter())
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_stop_listener)
+        # Với `gunicorn --preload`, thread listener không sống qua fork: tạo lại ở process con
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def _stop_listener():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()  # ghi nốt các bản ghi còn trong hàng đợi
+        if NonBlockingQueueHandler.dropped:
+            sys.stderr.write(f"logging: dropped {NonBlockingQueueHandler.dropped} records (queue full)\n")
+
+
+def _restart_listener_after_fork():
+    if _listener is not None and _listener._thread is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+def _debug_rate(route):
+    return _settings["debug_routes"].get(route, _settings["debug_rate"])
+
+
+def begin_request(route, request_id=None):
+    """Đặt ngữ cảnh log cho request hiện tại, trả về request_id đã dùng."""
+    if not request_id or not _REQUEST_ID_VALID.match(request_id):
+        request_id = uuid.uuid4().hex
+    rate = _debug_rate(route)
+    _request_id.set(request_id)
+    _request_route.set(route)
+    _debug_sampled.set(rate >= 1 or (rate > 0 and random.random() < rate))
+    _request_started.set(time.perf_counter())
+    return request_id
+
+
+def end_request(method, path, status):
+    """Ghi một dòng access log cho request hiện tại."""
+    started = _request_started.get()
+    if started is not None:
+        access_logger.info(
+            "%s %s %s", method, path, status,
+            extra={"method": method, "path": path, "status": status,
+                   "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+        )
+
+
+def clear_request():
+    """Xoá ngữ cảnh log của request (thread được dùng lại cho request sau)."""
+    _request_id.set(None)
+    _request_route.set(None)
+    _debug_sampled.set(None)
+    _request_started.set(None)
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def init_app(app):
+    """Gắn request_id / access log vào một Flask app."""
+    from flask import request
+
+    @app.before_request
+    def _log_begin_request():
+        begin_request(
+            request.url_rule.rule if request.url_rule else None,
+            request.headers.get(REQUEST_ID_HEADER)
+        )
+
+    @app.after_request
+    def _log_end_request(response):
+        request_id = current_request_id()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        end_request(request.method, request.path, response.status_code)
+        return response
+
+    @app.teardown_request
+    def _log_clear_request(exc):
+        clear_request()
@@ -0,0 +1,289 @@
+# profiler.py
+# Profile theo yêu cầu cho từng request (chỉ admin), dùng khi một route chậm trên production.
+#
+#   curl -H "X-Profile: 1" --cookie "access_token_cookie=..." https://.../api/pageshop?shop_id=1
+#   (hoặc thêm ?_profile=1 vào URL)
+#
+# Request được đánh dấu sẽ được:
+# - lấy mẫu stack của thread xử lý request mỗi PROFILER_SAMPLE_INTERVAL giây
+#   (profile theo thời gian thực, tính cả lúc chờ DB / I/O);
+# - ghi lại từng câu SQL cùng thời gian chạy và engine (chính / chỉ đọc).
+# Kết quả lưu trong PROFILER_DIR: <id>.json (thông tin + SQL) và <id>.speedscope.json
+# (mở bằng https://www.speedscope.app). Thư mục bị giới hạn PROFILER_MAX_FILES
+# profile và PROFILER_MAX_AGE, profile cũ bị xoá mỗi lần ghi profile mới.
+#
+# Request không có cờ chỉ tốn một lần tra header; thread lấy mẫu và listener SQL
+# chỉ tồn tại trong lúc có request đang được profile. PROFILER_ENABLED=0 bỏ hẳn hook.
+# Lấy mẫu dựa trên thread, nên cần worker sync/gthread (không dùng được với gevent).
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import logging_setup
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ARG = "_profile"
+PROFILE_ID = re.compile(r"^[\w.-]{1,100}$")
+
+_current = contextvars.ContextVar("profile", default=None)
+
+# Listener SQL chỉ được gắn khi có ít nhất một request đang được profile
+_sql_listeners = 0
+_sql_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Lấy mẫu stack của một thread và gom câu SQL của request đó."""
+
+    def __init__(self, interval, max_duration, max_sql):
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.max_duration = max_duration
+        self.max_sql = max_sql
+        self.samples = []  # (stack, thời gian) — stack là tuple frame từ gốc tới lá
+        self.sql = []
+        self.sql_dropped = 0
+        self.started = None
+        self.ended = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if self.ended is None:
+            self.ended = time.perf_counter()
+            self._stop.set()
+            self._sampler.join()
+
+    def _sample(self):
+        last = time.perf_counter()
+        deadline = last + self.max_duration
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now > deadline:
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples.append((tuple(reversed(stack)), now - last))
+            last = now
+
+    def record_sql(self, statement, duration, bind):
+        if len(self.sql) >= self.max_sql:
+            self.sql_dropped += 1
+            return
+        self.sql.append({
+            "statement": statement[:2000],
+            "duration_ms": round(duration * 1000, 3),
+            "bind": bind,
+        })
+
+    def to_speedscope(self, name):
+        """Định dạng "sampled" của speedscope."""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, weight in self.samples:
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(round(weight * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": name,
+            "exporter": "cuahang profiler",
+        }
+
+
+def to_folded(speedscope):
+    """Stack gộp dạng "a;b;c <ms>" cho flamegraph.pl / inferno."""
+    frames = speedscope["shared"]["frames"]
+    profile = speedscope["profiles"][0]
+    totals = {}
+    for ids, weight in zip(profile["samples"], profile["weights"]):
+        key = ";".join(f"{frames[i]['name']} ({os.path.basename(frames[i]['file'])}:{frames[i]['line']})" for i in ids)
+        totals[key] = totals.get(key, 0) + weight
+    return "".join(f"{stack} {round(ms, 3)}\n" for stack, ms in totals.items())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is not None and conn.info.get("profile_query_start"):
+        started = conn.info["profile_query_start"].pop()
+        profile.record_sql(statement, time.perf_counter() - started, conn.engine.url.render_as_string())
+
+
+def _attach_sql_listeners():
+    global _sql_listeners
+    with _sql_lock:
+        if _sql_listeners == 0:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _sql_listeners += 1
+
+
+def _detach_sql_listeners():
+    global _sql_listeners
+    with _sql_lock:
+        _sql_listeners -= 1
+        if _sql_listeners == 0:
+            event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def prune(directory, max_files, max_age):
+    """Xoá profile quá hạn, rồi xoá profile cũ nhất cho tới khi còn `max_files`."""
+    try:
+        metas = sorted(
+            (entry for entry in os.scandir(directory) if entry.name.endswith(".json")
+             and not entry.name.endswith(".speedscope.json")),
+            key=lambda entry: entry.stat().st_mtime, reverse=True
+        )
+    except FileNotFoundError:
+        return
+    cutoff = time.time() - max_age.total_seconds()
+    for i, entry in enumerate(metas):
+        if i >= max_files or entry.stat().st_mtime < cutoff:
+            profile_id = entry.name[:-len(".json")]
+            for name in (entry.name, profile_id + ".speedscope.json"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+def _save(config, profile, meta):
+    directory = config["PROFILER_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    profile_id = meta["id"]
+    name = f"{meta['method']} {meta['path']}"
+    with open(os.path.join(directory, profile_id + ".speedscope.json"), "w") as f:
+        json.dump(profile.to_speedscope(name), f)
+    # File meta ghi sau cùng: có meta nghĩa là profile đã đầy đủ
+    with open(os.path.join(directory, profile_id + ".json"), "w") as f:
+        json.dump(dict(meta, sql=profile.sql), f, ensure_ascii=False)
+    prune(directory, config["PROFILER_MAX_FILES"], config["PROFILER_MAX_AGE"])
+
+
+def list_profiles(directory):
+    """Thông tin các profile đã lưu (không kèm SQL), mới nhất trước."""
+    result = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return result
+    for entry in entries:
+        if entry.name.endswith(".json") and not entry.name.endswith(".speedscope.json"):
+            try:
+                with open(entry.path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta.pop("sql", None)
+            result.append(meta)
+    result.sort(key=lambda meta: meta["created_at"], reverse=True)
+    return result
+
+
+def profile_path(directory, profile_id, speedscope=False):
+    """Đường dẫn file của một profile, hoặc None nếu id không hợp lệ / không tồn tại."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(directory, profile_id + (".speedscope.json" if speedscope else ".json"))
+    return path if os.path.exists(path) else None
+
+
+def init_app(app, is_admin):
+    """Gắn hook profile vào Flask app. `is_admin()` kiểm tra người gọi hiện tại (trong request)."""
+    if not app.config["PROFILER_ENABLED"]:
+        return
+
+    from flask import request
+
+    @app.before_request
+    def _profile_begin():
+        if PROFILE_HEADER not in request.headers and PROFILE_ARG not in request.args:
+            return
+        if not is_admin():
+            return  # không báo lỗi: người ngoài không biết có profiler
+        profile = RequestProfile(
+            app.config["PROFILER_SAMPLE_INTERVAL"],
+            app.config["PROFILER_MAX_DURATION"],
+            app.config["PROFILER_MAX_SQL"]
+        )
+        _attach_sql_listeners()
+        _current.set(profile)
+        profile.start()
+
+    @app.after_request
+    def _profile_end(response):
+        profile = _current.get()
+        if profile is None:
+            return response
+        profile.stop()
+        _current.set(None)
+        _detach_sql_listeners()
+        created = datetime.utcnow()
+        profile_id = f"{created:%Y%m%dT%H%M%S}-{logging_setup.current_request_id() or os.urandom(8).hex()}"
+        meta = {
+            "id": profile_id,
+            "created_at": created.isoformat(),
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": response.status_code,
+            "duration_ms": round((profile.ended - profile.started) * 1000, 3),
+            "samples": len(profile.samples),
+            "sql_count": len(profile.sql) + profile.sql_dropped,
+            "sql_ms": round(sum(q["duration_ms"] for q in profile.sql), 3),
+            "sql_dropped": profile.sql_dropped,
+        }
+        try:
+            _save(app.config, profile, meta)
+            response.headers["X-Profile-Id"] = profile_id
+        except OSError:
+            app.logger.exception("profiler: không ghi được profile")
+        return response
+
+    @app.teardown_request
+    def _profile_cleanup(exc):
+        # after_request không chạy (lỗi trong hook khác): vẫn phải dừng thread lấy mẫu
+        profile = _current.get()
+        if profile is not None:
+            profile.stop()
+            _current.set(None)
+            _detach_sql_listeners()
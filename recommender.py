@@ -0,0 +1,200 @@
+# recommender.py
+# Tính offline top-K sản phẩm tương tự cho /api/products/suggested.
+#
+#   python recommender.py            # chỉ tính lại các sản phẩm trong hàng đợi san_pham_can_tinh_lai
+#   python recommender.py --full     # tính lại toàn bộ
+#
+# Độ tương tự = kết hợp cosine theo thuộc tính (danh mục, shop, khoảng giá)
+# và cosine theo hành vi (người dùng đã mua cùng sản phẩm), nhân thêm một hệ số
+# nhỏ theo điểm đánh giá trung bình của shop chứa sản phẩm hàng xóm.
+import argparse
+from datetime import datetime
+
+import numpy as np
+import scipy.sparse as sp
+
+from app import (
+    app, db, Product, Feedback, HoaDon, ChiTietHoaDon,
+    SanPhamTuongTu, SanPhamCanTinhLai
+)
+
+TOP_K = 10
+BLOCK_SIZE = 512  # số dòng tính cùng lúc, giới hạn bộ nhớ ở BLOCK_SIZE x số sản phẩm
+
+CONTENT_WEIGHT = 0.6
+INTERACTION_WEIGHT = 0.4
+# Trọng số từng nhóm thuộc tính trong vector nội dung
+CATEGORY_WEIGHT = 1.0
+PRICE_BAND_WEIGHT = 0.7
+SHOP_WEIGHT = 0.5
+# Khoảng giá theo log10(VND): 10k, ~30k, 100k, ... 100tr
+PRICE_BAND_EDGES = np.arange(4.0, 8.5, 0.5)
+
+
+def _one_hot(codes, weight):
+    """Ma trận one-hot (n x số giá trị khác nhau) cho một cột thuộc tính."""
+    _, inverse = np.unique(codes, return_inverse=True)
+    n = len(codes)
+    return sp.csr_matrix(
+        (np.full(n, weight, dtype=np.float32), (np.arange(n), inverse)),
+        shape=(n, inverse.max() + 1 if n else 0)
+    )
+
+
+def _normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.csr_matrix(sp.diags(1.0 / norms) @ matrix)
+
+
+def _load_products():
+    rows = db.session.query(Product.id, Product.category_id, Product.shop_id, Product.price).all()
+    ids = np.array([r.id for r in rows], dtype=np.int64)
+    category = np.array([r.category_id or 0 for r in rows], dtype=np.int64)
+    shop = np.array([r.shop_id or 0 for r in rows], dtype=np.int64)
+    price = np.array([r.price or 0.0 for r in rows], dtype=np.float64)
+    return ids, category, shop, price
+
+
+def _content_matrix(category, shop, price):
+    price_band = np.digitize(np.log10(np.maximum(price, 1.0)), PRICE_BAND_EDGES)
+    features = sp.hstack([
+        _one_hot(category, CATEGORY_WEIGHT),
+        _one_hot(shop, SHOP_WEIGHT),
+        _one_hot(price_band, PRICE_BAND_WEIGHT),
+    ]).tocsr()
+    return _normalize_rows(features)
+
+
+def _interaction_matrix(ids):
+    """Ma trận sản phẩm x người dùng từ lịch sử mua (log(1 + số lượng))."""
+    index = {pid: i for i, pid in enumerate(ids.tolist())}
+    rows = db.session.query(
+        ChiTietHoaDon.product_id, HoaDon.user_id, db.func.sum(ChiTietHoaDon.so_luong)
+    ).join(HoaDon, HoaDon.id == ChiTietHoaDon.hoadon_id).group_by(
+        ChiTietHoaDon.product_id, HoaDon.user_id
+    ).all()
+    rows = [r for r in rows if r[0] in index]
+    if not rows:
+        return sp.csr_matrix((len(ids), 1), dtype=np.float32)
+
+    users = np.array([r[1] for r in rows], dtype=np.int64)
+    _, user_idx = np.unique(users, return_inverse=True)
+    item_idx = np.array([index[r[0]] for r in rows], dtype=np.int64)
+    weights = np.log1p(np.array([r[2] for r in rows], dtype=np.float32))
+    matrix = sp.csr_matrix((weights, (item_idx, user_idx)), shape=(len(ids), user_idx.max() + 1))
+    return _normalize_rows(matrix)
+
+
+def _shop_quality(shop):
+    """Hệ số 0.95 - 1.05 theo điểm đánh giá trung bình (1-5 sao) của shop."""
+    ratings = dict(
+        db.session.query(Feedback.shop_id, db.func.avg(Feedback.rating))
+        .filter(Feedback.rating.isnot(None)).group_by(Feedback.shop_id).all()
+    )
+    avg = np.array([ratings.get(int(s)) or 3.0 for s in shop], dtype=np.float32)
+    return 1.0 + 0.05 * (np.clip(avg, 1.0, 5.0) - 3.0) / 2.0
+
+
+def _similarity_block(rows, content, interaction):
+    """Độ tương tự (dày, đối xứng) giữa các sản phẩm ở vị trí `rows` và toàn bộ sản phẩm."""
+    scores = CONTENT_WEIGHT * (content[rows] @ content.T).toarray()
+    scores += INTERACTION_WEIGHT * (interaction[rows] @ interaction.T).toarray()
+    scores[np.arange(len(rows)), rows] = -np.inf  # bỏ chính nó
+    return scores
+
+
+def _top_k(scores, k):
+    """(chỉ số, điểm) top-k mỗi dòng, đã sắp giảm dần."""
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def _thresholds(ids):
+    """Điểm của hàng xóm thứ K hiện tại của mỗi sản phẩm (0 nếu danh sách chưa đủ K, vì chỉ lưu điểm > 0)."""
+    kth = dict(
+        db.session.query(SanPhamTuongTu.product_id, SanPhamTuongTu.score)
+        .filter(SanPhamTuongTu.rank == TOP_K - 1).all()
+    )
+    return np.array([kth.get(int(pid), 0.0) for pid in ids], dtype=np.float64)
+
+
+def _write(ids, rows, neighbors, scores):
+    product_ids = [int(ids[r]) for r in rows]
+    SanPhamTuongTu.query.filter(SanPhamTuongTu.product_id.in_(product_ids)).delete(synchronize_session=False)
+    records = []
+    for pid, nbrs, scs in zip(product_ids, neighbors, scores):
+        for rank, (n, s) in enumerate(zip(nbrs, scs)):
+            if s > 0:
+                records.append({"product_id": pid, "rank": rank, "neighbor_id": int(ids[n]), "score": float(s)})
+    if records:
+        db.session.execute(SanPhamTuongTu.__table__.insert(), records)
+
+
+def build(full=False):
+    """Tính lại bảng san_pham_tuong_tu. Trả về số sản phẩm đã tính lại."""
+    started_at = datetime.utcnow()
+    ids, category, shop, price = _load_products()
+    position = {pid: i for i, pid in enumerate(ids.tolist())}
+
+    if full:
+        SanPhamTuongTu.query.delete()
+        target = np.arange(len(ids))
+    else:
+        changed = {r.product_id for r in SanPhamCanTinhLai.query.all()}
+        if not changed:
+            return 0
+        # Sản phẩm đã bị xóa: bỏ danh sách của nó
+        deleted = [pid for pid in changed if pid not in position]
+        if deleted:
+            SanPhamTuongTu.query.filter(SanPhamTuongTu.product_id.in_(deleted)).delete(synchronize_session=False)
+        # Sản phẩm đang có hàng xóm là sản phẩm thay đổi: điểm cũ có thể đã sai
+        stale = {
+            r.product_id for r in db.session.query(SanPhamTuongTu.product_id)
+            .filter(SanPhamTuongTu.neighbor_id.in_(changed)).distinct()
+        }
+        target = {position[pid] for pid in changed | stale if pid in position}
+
+    content = _content_matrix(category, shop, price)
+    interaction = _interaction_matrix(ids)
+    quality = _shop_quality(shop)
+
+    if not full and len(ids):
+        # Sản phẩm khác mà sản phẩm thay đổi nay lọt vào top-K của nó
+        changed_rows = np.array(sorted(position[pid] for pid in changed if pid in position), dtype=np.int64)
+        threshold = _thresholds(ids)
+        for start in range(0, len(changed_rows), BLOCK_SIZE):
+            block = changed_rows[start:start + BLOCK_SIZE]
+            # Điểm của sản phẩm thay đổi (dòng) trong danh sách của sản phẩm j (cột)
+            scores = _similarity_block(block, content, interaction) * quality[block][:, np.newaxis]
+            affected = np.nonzero((scores > threshold[np.newaxis, :]).any(axis=0))[0]
+            target.update(affected.tolist())
+        target = np.array(sorted(target), dtype=np.int64)
+
+    for start in range(0, len(target), BLOCK_SIZE):
+        block = target[start:start + BLOCK_SIZE]
+        scores = _similarity_block(block, content, interaction) * quality[np.newaxis, :]
+        neighbors, top_scores = _top_k(scores, TOP_K)
+        _write(ids, block, neighbors, top_scores)
+
+    # Chỉ xóa các đánh dấu có trước lúc bắt đầu; đánh dấu mới sẽ được xử lý lần sau
+    SanPhamCanTinhLai.query.filter(SanPhamCanTinhLai.created_at <= started_at).delete(synchronize_session=False)
+    db.session.commit()
+    return len(target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính bảng gợi ý sản phẩm tương tự")
+    parser.add_argument("--full", action="store_true", help="tính lại toàn bộ thay vì chỉ sản phẩm thay đổi")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all(bind_key=None)
+        n = build(full=args.full)
+        print(f"✅ Đã tính lại gợi ý cho {n} sản phẩm")
@@ -0,0 +1,44 @@
+# Chạy test trên một database SQLite tạm, không đụng tới instance/site.db.
+# Biến môi trường phải được đặt trước khi import app (app.py đọc cấu hình lúc import).
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="cuahang-test-")
+_db_file = os.path.join(_tmp, "site.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_file}")
+os.environ.setdefault("DATABASE_READ_URL", f"sqlite:///file:{_db_file}?mode=ro&uri=true")
+os.environ.setdefault("PROFILER_ENABLED", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    app_module.initialize_database()
+    return app_module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username, email, phone):
+    """Đăng ký (nếu chưa có) rồi đăng nhập; cookie JWT được giữ trong `client`."""
+    client.post("/api/auth/register", json={
+        "username": username, "email": email, "password": "matkhau123",
+        "first_name": "Test", "last_name": username, "phone": phone,
+    })
+    r = client.post("/api/auth/login", json={"username": username, "password": "matkhau123"})
+    assert r.status_code == 200, r.get_json()
+    return client
+
+
+@pytest.fixture(scope="session")
+def admin_client(app):
+    return login(app.test_client(), "admin_test", "admin@cuahang.com", "0900000001")
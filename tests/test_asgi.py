@@ -0,0 +1,74 @@
+# asgi.py và app.py dùng chung câu lệnh select(), nên trả cùng kết quả cho các API catalog.
+import asyncio
+
+import pytest
+
+pytest.importorskip("quart")
+pytest.importorskip("aiosqlite")
+
+import asgi  # noqa: E402
+from app import Product, SanPhamTuongTu, db  # noqa: E402
+from conftest import login  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def khach(app):
+    client = login(app.test_client(), "khach_asgi", "khach_asgi@example.com", "0900000004")
+    with app.app_context():
+        ids = [p.id for p in Product.query.order_by(Product.id).limit(3)]
+        SanPhamTuongTu.query.filter(SanPhamTuongTu.product_id.in_(ids)).delete()
+        db.session.add_all([
+            SanPhamTuongTu(product_id=ids[0], rank=0, neighbor_id=ids[2], score=0.9),
+            SanPhamTuongTu(product_id=ids[0], rank=1, neighbor_id=ids[1], score=0.5),
+            SanPhamTuongTu(product_id=ids[1], rank=0, neighbor_id=ids[2], score=0.8),
+        ])
+        db.session.commit()
+    r = client.post("/api/checkout", json={
+        "hinh_thuc_thanh_toan": "cod", "list_sanpham": [{"sanpham_id": ids[0], "so_luong": 1}],
+    })
+    assert r.status_code == 201, r.get_json()
+    client.ids = ids
+    return client
+
+
+def _quart_get(url, cookie=None):
+    async def run():
+        client = asgi.app.test_client()
+        headers = {"Cookie": f"access_token_cookie={cookie}"} if cookie else {}
+        response = await client.get(url, headers=headers)
+        return response.status_code, await response.get_json()
+    return asyncio.run(run())
+
+
+def _names(body):
+    return [p["name"] for p in body["products"]]
+
+
+@pytest.mark.parametrize("url", [
+    "/api/products/bestseller",
+    "/api/products/suggested",
+    "/api/products/suggested?product_id={0}",
+    "/api/products/suggested?product_id={0}&limit=1",
+])
+def test_flask_and_quart_agree(khach, url):
+    url = url.format(*khach.ids)
+    cookie = khach.get_cookie("access_token_cookie").value
+    flask_r = khach.get(url)
+    status, body = _quart_get(url, cookie)
+    assert flask_r.status_code == status == 200
+    assert _names(flask_r.get_json()) == _names(body)
+
+
+def test_quart_ignores_revoked_token(app, khach):
+    cookie = khach.get_cookie("access_token_cookie").value
+    _, anonymous = _quart_get("/api/products/suggested")
+    _, personal = _quart_get("/api/products/suggested", cookie)
+    assert _names(personal) != _names(anonymous)
+    with app.app_context():
+        from flask_jwt_extended import decode_token
+        import app as cuahang
+        cuahang.revoke_token(decode_token(cookie))
+        db.session.commit()
+    # Token bị thu hồi: gợi ý chung (sản phẩm mới nhất) thay vì theo lịch sử mua
+    _, revoked = _quart_get("/api/products/suggested", cookie)
+    assert _names(revoked) == _names(anonymous)
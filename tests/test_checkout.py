@@ -0,0 +1,70 @@
+# Checkout trừ kho nguyên tử: N đơn đồng thời trên S sản phẩm tồn kho -> đúng S đơn thành công.
+import threading
+
+import pytest
+
+from app import Category, ChiTietHoaDon, Product, db
+from conftest import login
+
+
+@pytest.fixture(scope="module")
+def khach(app):
+    return login(app.test_client(), "khach_checkout", "khach_checkout@example.com", "0900000002")
+
+
+def _tao_san_pham(app, stock):
+    with app.app_context():
+        p = Product(name="Hàng giới hạn", price=100000, stock=stock, category_id=Category.query.first().id)
+        db.session.add(p)
+        db.session.commit()
+        return p.id
+
+
+@pytest.mark.parametrize("body", [
+    ["list_sanpham"],
+    {"hinh_thuc_thanh_toan": "cod", "list_sanpham": "1,2"},
+    {"hinh_thuc_thanh_toan": "cod", "list_sanpham": [1, 2]},
+    {"hinh_thuc_thanh_toan": "cod", "list_sanpham": [{"sanpham_id": "x", "so_luong": 1}]},
+    {"hinh_thuc_thanh_toan": "chuyen khoan", "list_sanpham": [{"sanpham_id": 1, "so_luong": 1}]},
+    {"hinh_thuc_thanh_toan": ["cod"], "list_sanpham": [{"sanpham_id": 1, "so_luong": 1}]},
+])
+def test_invalid_checkout_is_rejected(app, khach, body):
+    with app.app_context():
+        before = db.session.get(Product, 1).stock
+    r = khach.post("/api/checkout", json=body)
+    assert r.status_code == 400, r.get_json()
+    with app.app_context():
+        assert db.session.get(Product, 1).stock == before
+
+
+def test_concurrent_checkouts_never_oversell(app, khach):
+    stock, n = 10, 40
+    product_id = _tao_san_pham(app, stock)
+    cookie = khach.get_cookie("access_token_cookie").value
+    statuses = []
+    start = threading.Barrier(n)
+
+    def dat_hang():
+        client = app.test_client()
+        client.set_cookie("access_token_cookie", cookie)
+        start.wait()
+        r = client.post("/api/checkout", json={
+            "hinh_thuc_thanh_toan": "cod",
+            "list_sanpham": [{"sanpham_id": product_id, "so_luong": 1}],
+        })
+        statuses.append(r.status_code)
+
+    threads = [threading.Thread(target=dat_hang) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert statuses.count(201) == stock
+    assert statuses.count(409) == n - stock
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == 0
+        da_ban = db.session.query(db.func.sum(ChiTietHoaDon.so_luong)).filter(
+            ChiTietHoaDon.product_id == product_id
+        ).scalar()
+        assert da_ban == stock
@@ -0,0 +1,122 @@
+# Route @db_route("read") chỉ được chạm engine "doc"; route ghi chỉ chạm engine chính.
+import pytest
+from sqlalchemy import event
+
+from app import Category, Product, Shop, User, _sqlite_pragmas, db, db_route
+
+
+class StatementLog:
+    """Ghi lại các câu SQL chạy trên engine chính và engine "doc"."""
+
+    def __init__(self, app):
+        with app.app_context():
+            self.engines = {"primary": db.engines[None], "doc": db.engines["doc"]}
+        self.statements = {name: [] for name in self.engines}
+        self._listeners = []
+        for name, engine in self.engines.items():
+            def listener(conn, cursor, statement, parameters, context, executemany, name=name):
+                self.statements[name].append(statement)
+            event.listen(engine, "before_cursor_execute", listener)
+            self._listeners.append((engine, listener))
+
+    def clear(self):
+        for statements in self.statements.values():
+            statements.clear()
+
+    def remove(self):
+        for engine, listener in self._listeners:
+            event.remove(engine, "before_cursor_execute", listener)
+
+
+@pytest.fixture
+def sql(app):
+    log = StatementLog(app)
+    yield log
+    log.remove()
+
+
+@pytest.fixture(scope="module")
+def shop_id(app, admin_client):
+    with app.app_context():
+        user = User.query.filter_by(username="admin_test").one()
+        if user.shop is None:
+            r = admin_client.post("/api/newshop", data={"ten_shop": "Shop test", "mo_ta": "", "the_loai": ""})
+            assert r.status_code in (200, 201), r.get_json()
+        return Shop.query.filter_by(user_id=user.id).one().id
+
+
+@pytest.fixture(scope="module")
+def product_id(app):
+    with app.app_context():
+        return Product.query.first().id
+
+
+def test_read_routes_never_touch_primary(app, admin_client, shop_id, product_id, sql):
+    urls = [
+        "/api/categories",
+        "/api/products/discount",
+        "/api/products/bestseller",
+        "/api/products/suggested",
+        f"/api/products/{product_id}",
+        "/api/admin/xemsanpham",
+        "/api/admin/xemkho",
+        f"/api/pageshop?shop_id={shop_id}",
+        f"/api/feedbackofshop/{shop_id}",
+    ]
+    for url in urls:
+        sql.clear()
+        r = admin_client.get(url)
+        assert r.status_code == 200, (url, r.get_json())
+        assert sql.statements["primary"] == [], url
+        assert sql.statements["doc"], url
+
+
+def test_every_read_route_is_covered(app):
+    # Thêm @db_route("read") cho route mới thì phải thêm URL vào test ở trên
+    read_views = {name for name, view in app.view_functions.items() if getattr(view, "db_route", None) == "read"}
+    assert read_views == {
+        "get_categories", "get_discount_products", "get_bestseller_products",
+        "get_suggested_products", "get_product_details", "admin_xemsanpham",
+        "admin_xemkho", "get_pageshop", "feedback_of_shop",
+    }
+
+
+def test_write_route_uses_primary_only(client, shop_id, sql):
+    r = client.post("/api/feedbackofshop", json={"shop_id": shop_id, "rating": 5, "comment": "tốt"})
+    assert r.status_code in (200, 201), r.get_json()
+    assert sql.statements["primary"]
+    assert sql.statements["doc"] == []
+
+
+def test_flush_in_read_route_fails(app):
+    @db_route("read")
+    def them_danh_muc():
+        db.session.add(Category(name="Không được ghi"))
+        db.session.flush()
+
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            them_danh_muc()
+        db.session.rollback()
+        assert Category.query.filter_by(name="Không được ghi").count() == 0
+
+
+def test_bulk_update_in_read_route_fails(app, product_id):
+    @db_route("read")
+    def doi_gia():
+        Product.query.filter_by(id=product_id).update({"price": 1}, synchronize_session=False)
+
+    with app.app_context():
+        before = db.session.get(Product, product_id).price
+        db.session.rollback()
+        with pytest.raises(RuntimeError):
+            doi_gia()
+        db.session.rollback()
+        assert db.session.get(Product, product_id).price == before
+
+
+def test_pragmas_only_on_primary(app):
+    # PRAGMA journal_mode=WAL là lệnh ghi, không chạy được trên engine mode=ro
+    with app.app_context():
+        assert event.contains(db.engines[None], "connect", _sqlite_pragmas)
+        assert not event.contains(db.engines["doc"], "connect", _sqlite_pragmas)
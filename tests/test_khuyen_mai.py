@@ -0,0 +1,49 @@
+# Dữ liệu khuyến mãi sai kiểu phải bị từ chối bằng 400, không được lọt tới DB.
+import pytest
+
+from app import KhuyenMai, Product, db
+
+
+@pytest.fixture
+def payload(app):
+    with app.app_context():
+        product_id = Product.query.first().id
+    return {
+        "ten": "Giảm giá test", "pham_vi": "san_pham", "doi_tuong_id": product_id,
+        "kieu_giam": "phan_tram", "gia_tri": 10,
+        "bat_dau": "2030-01-01T00:00:00", "ket_thuc": "2030-01-02T00:00:00",
+    }
+
+
+@pytest.mark.parametrize("changes", [
+    {"bat_dau": 12},
+    {"ket_thuc": ["2030-01-02"]},
+    {"gia_tri": "nan"},
+    {"gia_tri": "inf", "kieu_giam": "so_tien"},
+    {"gia_tri": 150},
+    {"pham_vi": ["san_pham"]},
+    {"ket_thuc": "2029-12-31T00:00:00"},
+])
+def test_invalid_promotion_is_rejected(app, admin_client, payload, changes):
+    with app.app_context():
+        before = KhuyenMai.query.count()
+    r = admin_client.post("/api/admin/khuyenmai", json=dict(payload, **changes))
+    assert r.status_code == 400, r.get_json()
+    with app.app_context():
+        assert KhuyenMai.query.count() == before
+
+
+def test_non_object_body_is_rejected(admin_client):
+    r = admin_client.post("/api/admin/khuyenmai", json=["ten", "gia_tri"])
+    assert r.status_code == 400
+
+
+def test_valid_promotion_is_created(app, admin_client, payload):
+    r = admin_client.post("/api/admin/khuyenmai", json=payload)
+    assert r.status_code == 201, r.get_json()
+    km_id = r.get_json()["khuyen_mai"]["id"]
+    r = admin_client.put(f"/api/admin/khuyenmai/{km_id}", json={"bat_dau": 12})
+    assert r.status_code == 400
+    with app.app_context():
+        db.session.delete(db.session.get(KhuyenMai, km_id))
+        db.session.commit()
@@ -0,0 +1,59 @@
+# Bộ đếm lượt xem/mua: một sản phẩm đã bị xoá không được chặn cả lô, và mốc
+# của score được dời lên định kỳ mà không đổi thứ tự sắp xếp.
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as cuahang
+from app import DiemPhoBien, MocDiemPhoBien, Product, db
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        cuahang.flush_popularity_counters()  # phần còn lại của test khác
+        yield
+        db.session.rollback()
+
+
+def _score(product_id):
+    db.session.expire_all()
+    row = db.session.get(DiemPhoBien, product_id)
+    return row.score if row else None
+
+
+def test_deleted_product_does_not_block_batch(ctx):
+    product_id = Product.query.first().id
+    luot_xem = db.session.get(DiemPhoBien, product_id).luot_xem if _score(product_id) else 0
+    missing_id = db.session.query(db.func.max(Product.id)).scalar() + 1000
+
+    cuahang.ghi_nhan_tuong_tac(product_id, luot_xem=1)
+    cuahang.ghi_nhan_tuong_tac(missing_id, luot_xem=1)
+    assert cuahang.flush_popularity_counters() == 1
+
+    assert db.session.get(DiemPhoBien, product_id).luot_xem == luot_xem + 1
+    assert db.session.get(DiemPhoBien, missing_id) is None
+    assert cuahang._tuong_tac_cho_ghi == {}
+
+
+def test_rebase_keeps_order_and_ratio(ctx, app):
+    a, b = [p.id for p in Product.query.order_by(Product.id).limit(2)]
+    cuahang.ghi_nhan_tuong_tac(a, luot_xem=3)
+    cuahang.ghi_nhan_tuong_tac(b, luot_xem=1)
+    cuahang.flush_popularity_counters()
+    ratio = _score(a) / _score(b)
+
+    # Giả lập mốc đã cũ hơn POPULARITY_REBASE_AFTER
+    tuoi = app.config["POPULARITY_REBASE_AFTER"] + timedelta(days=7)
+    moc = db.session.get(MocDiemPhoBien, 1)
+    moc.moc -= tuoi
+    db.session.commit()
+    truoc = _score(a)
+
+    cuahang.ghi_nhan_tuong_tac(b, luot_xem=0)
+    cuahang.flush_popularity_counters()
+
+    moc = db.session.query(MocDiemPhoBien.moc).scalar()
+    assert datetime.utcnow() - moc < timedelta(minutes=1)
+    assert _score(a) < truoc
+    assert _score(a) / _score(b) == pytest.approx(ratio)
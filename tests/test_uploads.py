@@ -0,0 +1,71 @@
+# Tải ảnh theo đoạn: PATCH đồng thời trên cùng upload chỉ có một request được ghi.
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import app as cuahang
+from conftest import login
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+class ChamRai(io.BytesIO):
+    """Body gửi chậm, để các request đồng thời thật sự chồng lên nhau."""
+
+    def read(self, size=-1):
+        time.sleep(0.001)
+        return super().read(min(size, 8192) if size and size > 0 else size)
+
+
+@pytest.fixture(scope="module")
+def nguoi_ban(app):
+    return login(app.test_client(), "nguoi_ban_upload", "nguoi_ban_upload@example.com", "0900000003")
+
+
+def test_concurrent_chunks_only_one_written(app, nguoi_ban):
+    size, chunk = 200000, 100000
+    r = nguoi_ban.post("/api/uploads", json={"filename": "a.png", "content_type": "image/png", "size": size})
+    upload_id = r.get_json()["upload"]["upload_id"]
+    cookie = nguoi_ban.get_cookie("access_token_cookie").value
+    bodies = [PNG + os.urandom(chunk - len(PNG)) for _ in range(6)]
+    statuses = [None] * len(bodies)
+    start = threading.Barrier(len(bodies))
+
+    def gui(i):
+        client = app.test_client()
+        client.set_cookie("access_token_cookie", cookie)
+        start.wait()
+        statuses[i] = client.patch(
+            f"/api/uploads/{upload_id}", input_stream=ChamRai(bodies[i]),
+            headers={"Upload-Offset": "0", "Content-Length": str(chunk)}
+        ).status_code
+
+    threads = [threading.Thread(target=gui, args=(i,)) for i in range(len(bodies))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert statuses.count(200) == 1
+    assert statuses.count(409) == len(bodies) - 1
+    winner = bodies[statuses.index(200)]
+    with open(cuahang._file_tai_len_tam(upload_id), "rb") as f:
+        assert f.read() == winner
+
+    rest = os.urandom(size - chunk)
+    r = nguoi_ban.patch(f"/api/uploads/{upload_id}", data=rest, headers={"Upload-Offset": str(chunk)})
+    assert r.status_code == 200, r.get_json()
+    upload = r.get_json()["upload"]
+    digest = hashlib.sha256(winner + rest).hexdigest()
+    assert upload["sha256"] == digest
+    assert upload["image_url"] == f"images/prod_{digest}.png"
+    path = os.path.join(app.static_folder, upload["image_url"])
+    try:
+        with open(path, "rb") as f:
+            assert f.read() == winner + rest
+    finally:
+        os.remove(path)
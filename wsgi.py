@@ -0,0 +1,15 @@
+# wsgi.py
+# Entry point production:
+#
+#   gunicorn wsgi:app      (cấu hình trong gunicorn.conf.py)
+#   python wsgi.py         (tương đương, chạy gunicorn với cùng cấu hình)
+#
+# `python app.py` chỉ dùng cho phát triển (Flask dev server, debug=True).
+from app import app
+
+if __name__ == '__main__':
+    import sys
+    from gunicorn.app.wsgiapp import run
+
+    sys.argv = ["gunicorn", "wsgi:app"] + sys.argv[1:]
+    run()